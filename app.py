@@ -1,24 +1,39 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 import os
 import time
-import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageDraw
-from rembg import remove, new_session
-import cv2
+import hmac
+import threading
+import asyncio
+from PIL import Image, ImageDraw
 from io import BytesIO
 import base64
-import tempfile
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
-import shutil
 import json
+import zipfile
+import logging
+from contextlib import contextmanager
+from worker_pool import InferencePool, PoolFullError
+from mask_cache import MaskCache, image_fingerprint
+from jobs import JobStore, FINISHED_STATUSES
+from batch_inference import predict_masks
+from session_registry import SessionRegistry
+from runtime_config import RuntimeConfig, MATTING_THREADS
+from compositing import BackgroundAssetCache
+from asset_store import BlobStore
+from pipeline import SETTINGS_SCHEMA, StageCache, coerce_setting, validate_settings
+from pipeline.graph import measure
+import encoders
+from profiler import profiled, write_trace
+from metrics import MetricsRegistry, Counter, Histogram, Gauge, STAGE_BUCKETS, process_rss_bytes
 
 app = FastAPI()
+logger = logging.getLogger("uvicorn.error")
 
 # Configure CORS
 app.add_middleware(
@@ -27,6 +42,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Result-Id", "Server-Timing"],
 )
 
 # Configure upload folder
@@ -38,8 +54,223 @@ if not os.path.exists(UPLOAD_FOLDER):
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# Initialize session
-session = new_session("u2net_human_seg")
+# ONNX Runtime and OpenCV thread pools; size them so workers x threads
+# fits the node instead of every worker claiming every core
+runtime_config = RuntimeConfig.from_env()
+
+# Sessions are loaded on first use and evicted under a memory budget
+session_registry = SessionRegistry.from_env(runtime_config)
+
+# Raw model masks, reused when only background or finishing settings change
+mask_cache = MaskCache.from_env()
+
+# Decoded background images, keyed by content hash and target size
+background_assets = BackgroundAssetCache.from_env()
+
+# Uploaded background images, referenced by content id in process requests
+background_store = BlobStore.from_env("BACKGROUND_STORE")
+
+# Processed results and their encoded download formats
+result_store = BlobStore.from_env("RESULT_STORE")
+encoded_results = BlobStore.from_env("ENCODED_RESULT_STORE", default_mb=128)
+
+# Asynchronous jobs for long Ultra HD runs
+job_store = JobStore.from_env()
+JOB_EVENT_INTERVAL = 0.25
+
+# Batch endpoint limits
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "50"))
+
+# Long side of the quick preview cutout returned ahead of the full result
+PREVIEW_MAX_SIDE = int(os.getenv("PREVIEW_MAX_SIDE", "512"))
+
+# Ultra HD images above this size are matted at reduced resolution
+WORKING_MAX_PIXELS = int(os.getenv("WORKING_MAX_PIXELS", str(24 * 1000 * 1000)))
+
+# Intermediate pipeline stages; changing a late setting only reruns the
+# stages after it
+stage_cache = StageCache.from_env()
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+# Warm-up inference run at startup; /api/ready answers 503 until it is done
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+readiness = {'status': "warming" if WARMUP_ON_STARTUP else "ready", 'seconds': None, 'error': None}
+_warm_up_task = None
+
+# Opt-in sampled call-stack traces (`trace=1`), only for requests that
+# carry PROFILE_ADMIN_TOKEN in the X-Admin-Token header
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_TRACE_DIR = os.getenv("PROFILE_TRACE_DIR", "traces")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# Bounded worker pool so inference never blocks the event loop
+inference_pool = InferencePool.from_env()
+
+# Prometheus metrics served on /metrics
+metrics = MetricsRegistry()
+REQUESTS = metrics.register(Counter(
+    "bgremover_requests_total",
+    "Processing requests by endpoint, quality, model and outcome",
+    ("endpoint", "quality", "model", "status")
+))
+REQUEST_LATENCY = metrics.register(Histogram(
+    "bgremover_request_duration_seconds",
+    "End-to-end processing time, including time queued for a worker",
+    ("endpoint", "quality", "model")
+))
+STAGE_LATENCY = metrics.register(Histogram(
+    "bgremover_stage_duration_seconds",
+    "Wall time of pipeline stages that ran (cache hits are not observed)",
+    ("stage", "quality"),
+    STAGE_BUCKETS
+))
+
+# Pipeline stage names as reported in metrics; Standard quality's
+# "matting" is the plain cutout
+STAGE_METRIC_NAMES = {
+    'prepare': 'preparation',
+    'mask': 'inference',
+    'cutout': 'matting',
+    'refined': 'refinement',
+    'upsampled': 'upsampling',
+    'enhanced': 'enhancement',
+    'scaled': 'scaling',
+    'finished': 'finishing',
+    'result': 'compositing',
+    'encode': 'encoding',
+}
+
+def cache_samples(attribute):
+    caches = {
+        'mask': mask_cache,
+        'stage': stage_cache,
+        'background': background_assets,
+    }
+    return [({'cache': name}, getattr(cache, attribute)) for name, cache in caches.items()]
+
+_runtime_report = None
+
+def runtime_report():
+    """runtime_config.report(), computed once
+
+    The thread settings do not change after start-up, and building the
+    report imports OpenCV and ONNX Runtime, so it is not redone per scrape.
+    """
+    global _runtime_report
+    if _runtime_report is None:
+        _runtime_report = runtime_config.report()
+    return _runtime_report
+
+def thread_samples():
+    report = runtime_report()
+    return [
+        ({'pool': 'ort_intra_op'}, report['ort_intra_op_threads']),
+        ({'pool': 'ort_inter_op'}, report['ort_inter_op_threads']),
+        ({'pool': 'opencv'}, report['opencv_threads']),
+        ({'pool': 'matting'}, MATTING_THREADS),
+        ({'pool': 'inference_workers'}, inference_pool.max_workers),
+    ]
+
+metrics.register(Gauge(
+    "bgremover_inference_in_flight",
+    "Jobs running on the inference pool",
+    lambda: [({}, inference_pool.in_flight)]
+))
+metrics.register(Gauge(
+    "bgremover_inference_queued",
+    "Jobs waiting for an inference worker",
+    lambda: [({}, inference_pool.queued)]
+))
+metrics.register(Gauge(
+    "bgremover_model_load_seconds",
+    "Time the last load of each model took",
+    lambda: [({'model': name}, seconds) for name, seconds in session_registry.load_times.items()]
+))
+metrics.register(Gauge(
+    "bgremover_models_resident_megabytes",
+    "Estimated memory of loaded models",
+    lambda: [({}, session_registry.resident_mb)]
+))
+metrics.register(Gauge(
+    "bgremover_cache_hits_total",
+    "Cache hits by cache",
+    lambda: cache_samples('hits'),
+    metric_type="counter"
+))
+metrics.register(Gauge(
+    "bgremover_cache_misses_total",
+    "Cache misses by cache",
+    lambda: cache_samples('misses'),
+    metric_type="counter"
+))
+metrics.register(Gauge(
+    "bgremover_runtime_threads",
+    "Configured thread pools of the API process",
+    thread_samples
+))
+metrics.register(Gauge(
+    "bgremover_process_resident_memory_bytes",
+    "Resident memory of the API process",
+    lambda: [({}, rss) for rss in [process_rss_bytes()] if rss is not None]
+))
+
+def record_request(endpoint, settings, status, seconds, timings=None):
+    quality = "Ultra HD" if settings.get('quality') == "Ultra HD" else "Standard"
+    model = session_registry.resolve(settings.get('model'), quality)
+    REQUESTS.inc(endpoint=endpoint, quality=quality, model=model, status=status)
+    REQUEST_LATENCY.observe(seconds, endpoint=endpoint, quality=quality, model=model)
+    for timing in timings or []:
+        stage = STAGE_METRIC_NAMES.get(timing['stage'])
+        if stage and not timing['cached']:
+            STAGE_LATENCY.observe(timing['wall_ms'] / 1000, stage=stage, quality=quality)
+
+@contextmanager
+def observe_request(endpoint, settings):
+    """Count and time a processing call; store its timings in the yielded dict"""
+    observation = {'timings': None}
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield observation
+        status = "ok"
+    except PoolFullError:
+        status = "rejected"
+        raise
+    finally:
+        record_request(endpoint, settings, status, time.perf_counter() - started, observation['timings'])
+
+def server_timing(timings, decode_ms=None, elapsed_ms=None):
+    """Server-Timing header value for the stages of one processing call
+
+    `elapsed_ms` is the time spent waiting on the inference pool; whatever
+    the stages do not account for is reported as `queue`.
+    """
+    entries = []
+    if decode_ms is not None:
+        entries.append(f"decode;dur={decode_ms:.1f}")
+    worker_ms = 0.0
+    for timing in timings or []:
+        worker_ms += timing['wall_ms']
+        name = STAGE_METRIC_NAMES.get(timing['stage'], timing['stage'])
+        entry = f"{name};dur={timing['wall_ms']:.1f}"
+        if timing['cached']:
+            entry += ';desc="cached"'
+        entries.append(entry)
+    if elapsed_ms is not None:
+        entries.append(f"queue;dur={max(elapsed_ms - worker_ms, 0):.1f}")
+        entries.append(f"total;dur={elapsed_ms + (decode_ms or 0):.1f}")
+    return ", ".join(entries)
+
+def check_trace_access(request):
+    """Only admins may profile; profiling is off while no token is set"""
+    token = request.headers.get('x-admin-token', '')
+    if not PROFILE_ADMIN_TOKEN or not hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode()):
+        raise HTTPException(
+            status_code=403,
+            detail='Profiling requires a valid X-Admin-Token'
+        )
 
 # Pydantic models for request validation
 class ProcessRequest(BaseModel):
@@ -58,6 +289,14 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"detail": str(exc)}
     )
 
+@app.exception_handler(PoolFullError)
+async def pool_full_exception_handler(request: Request, exc: PoolFullError):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     return JSONResponse(
@@ -69,177 +308,124 @@ async def general_exception_handler(request: Request, exc: Exception):
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-def process_image(image, settings):
-    """Process image with specified settings"""
-    try:
-        # Convert to RGB if needed
-        img = image.convert('RGB') if image.mode != 'RGB' else image
-        
-        if settings.get('quality') == "Ultra HD":
-            # Stage 1: Initial background removal
-            result = remove(
-                img,
-                session=session,
-                alpha_matting=True,
-                alpha_matting_foreground_threshold=settings.get('matting_foreground', 240),
-                alpha_matting_background_threshold=settings.get('matting_background', 10),
-                alpha_matting_erode_size=settings.get('matting_erode', 15),
-                post_process_mask=settings.get('preserve_details', True)
+def get_pipeline():
+    """Shared processing pipeline, built by the startup handler
+
+    Building it imports rembg, OpenCV and pymatting, so importing the app
+    alone (tests, tooling) stays cheap.
+    """
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            from pipeline import Pipeline
+            runtime_config.apply_opencv()
+            _pipeline = Pipeline(
+                session_registry,
+                mask_cache,
+                stage_cache,
+                background_assets,
+                WORKING_MAX_PIXELS,
+                os.getenv("PIPELINE_TRACE_MEMORY", "0") == "1"
             )
-            
-            # Stage 2: Create high-precision mask
-            mask = remove(img, session=session, only_mask=True)
-            
-            # Stage 3: Edge refinement
-            if settings.get('edge_refinement', True):
-                result = edge_refinement(result, mask)
-            
-            # Stage 4: Detail enhancement
-            if settings.get('enhance_details', True):
-                result = detail_enhancement(result)
-            
-            # Stage 5: Super Resolution
-            if settings.get('super_resolution', False) and max(img.size) < 4000:
-                result = apply_super_resolution(result)
-            
-            # Stage 6: Upscale if needed
-            if settings.get('upscale_small', False) and max(img.size) < 2000:
-                result = result.resize((img.size[0]*2, img.size[1]*2), Image.LANCZOS)
-        else:
-            # Standard quality processing
-            result = remove(img, session=session)
-
-        # Apply background if specified
-        if settings.get('background_type') != "Transparent":
-            result = apply_background(result, settings)
-
-        return result
+        return _pipeline
+
+def warm_up():
+    """Load the default models and run a small image through both qualities
+
+    Pays for imports, model loading, graph optimization and the JIT
+    compilation of alpha matting before the first real request does.
+    """
+    started = time.perf_counter()
+    image = Image.new('RGB', (96, 96), (40, 90, 160))
+    ImageDraw.Draw(image).ellipse((24, 16, 72, 80), fill=(220, 180, 150))
+    for quality in ("Standard", "Ultra HD"):
+        get_pipeline().run(image, {'quality': quality})
+    return time.perf_counter() - started
+
+def process_image(image, settings, progress=None, mask=None):
+    """Run the shared pipeline; returns a PipelineResult"""
+    try:
+        return get_pipeline().run(image, settings, progress, mask)
     except Exception as e:
         raise Exception(f"Error processing image: {str(e)}")
 
-def edge_refinement(image, mask):
-    """Refine edges of the processed image"""
-    img_array = np.array(image)
-    mask_array = np.array(mask)
-    
-    if len(mask_array.shape) == 3:
-        mask_array = cv2.cvtColor(mask_array, cv2.COLOR_RGB2GRAY)
-    
-    mask_array = mask_array.astype(np.float32) / 255.0
-    
-    # Edge refinement
-    mask_array = cv2.bilateralFilter(mask_array, 9, 75, 75)
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3,3))
-    mask_array = cv2.morphologyEx(mask_array, cv2.MORPH_CLOSE, kernel)
-    mask_array = cv2.morphologyEx(mask_array, cv2.MORPH_OPEN, kernel)
-    
-    mask_array = (mask_array * 255).clip(0, 255).astype(np.uint8)
-    
-    if image.mode == 'RGBA':
-        rgb = img_array[:, :, :3]
-        alpha = mask_array
-        result = np.dstack((rgb, alpha))
-    else:
-        result = np.dstack((img_array, mask_array))
-    
-    return Image.fromarray(result)
+def run_process_job(image_bytes, settings, progress=None, output_format="PNG"):
+    """Decode, process and encode one image; runs on the inference pool
 
-def detail_enhancement(image):
-    """Enhance details in the processed image"""
-    img_array = np.array(image)
-    
-    if image.mode == 'RGBA':
-        rgb = img_array[:, :, :3]
-        alpha = img_array[:, :, 3]
-        lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)
-    else:
-        lab = cv2.cvtColor(img_array, cv2.COLOR_RGB2LAB)
-    
-    l, a, b = cv2.split(lab)
-    l = l.astype(np.float32)
-    
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-    l = clahe.apply(l.astype(np.uint8)).astype(np.float32)
-    
-    lab = cv2.merge((l.astype(np.uint8), a, b))
-    rgb = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
-    
-    if image.mode == 'RGBA':
-        result = np.dstack((rgb, alpha))
-    else:
-        result = rgb
-    
-    return Image.fromarray(result)
+    Returns the default profile PNG that is kept as the stored result, an
+    EncodeResult for the response when it needs another format or
+    profile (else None), and the per-stage timings.
+    """
+    image = Image.open(BytesIO(image_bytes))
+    result = process_image(image, settings, progress)
+    if result.image is None:
+        return None, None, None
 
-def apply_super_resolution(image):
-    """Apply super resolution to enhance details"""
-    return image.resize((image.size[0]*2, image.size[1]*2), Image.LANCZOS)
+    png, timing = measure('encode', encoders.encode, result.image, "PNG")
+    timing.output_bytes = len(png.data)
+    result.timings.append(timing)
+    encoded = None
+    profile = settings.get('profile', encoders.DEFAULT_PROFILE)
+    if output_format != "PNG" or profile != encoders.DEFAULT_PROFILE:
+        encoded, timing = measure(
+            'encode_output', encoders.encode, result.image, output_format, profile, settings.get('lossless', False)
+        )
+        timing.output_bytes = len(encoded.data)
+        result.timings.append(timing)
+    return png.data, encoded, result.timings_dict()
 
-def apply_background(image, settings):
-    """Apply background to the processed image"""
-    bg_type = settings.get('background_type')
-    
-    if bg_type == "Color":
-        bg_color = settings.get('bg_color', "#FFFFFF")
-        bg = Image.new("RGB", image.size, bg_color)
-        if image.mode == 'RGBA':
-            alpha = image.split()[3]
-            bg.paste(image, mask=alpha)
-        else:
-            bg.paste(image)
-        return bg
-    
-    elif bg_type == "Gradient":
-        start_color = settings.get('gradient_start', "#4CAF50")
-        end_color = settings.get('gradient_end', "#2196F3")
-        return apply_gradient_background(image, start_color, end_color)
-    
-    elif bg_type == "Image":
-        try:
-            bg_image_data = settings.get('bg_image')
-            if not bg_image_data or not bg_image_data.startswith('data:image/'):
-                raise ValueError("Invalid background image data")
-                
-            # Decode base64 background image
-            bg_image_bytes = base64.b64decode(bg_image_data.split(',')[1])
-            bg_image = Image.open(BytesIO(bg_image_bytes))
-            
-            # Resize background image to match the main image size
-            bg_image = bg_image.resize(image.size, Image.LANCZOS)
-            
-            # Apply the background
-            if image.mode == 'RGBA':
-                alpha = image.split()[3]
-                bg_image.paste(image, mask=alpha)
-            else:
-                bg_image.paste(image)
-            return bg_image
-            
-        except Exception as e:
-            raise Exception(f"Error applying background image: {str(e)}")
-    
-    return image
-
-def apply_gradient_background(image, start_color, end_color):
-    """Apply gradient background to the image"""
-    width, height = image.size
-    gradient_image = Image.new('RGB', (width, height), start_color)
-    gradient_image.putpixel((0, 0), start_color)
-    gradient_image.putpixel((width-1, 0), end_color)
-    gradient_image.putpixel((0, height-1), start_color)
-    gradient_image.putpixel((width-1, height-1), end_color)
-    
-    mask = Image.new('L', image.size, 0)
-    mask.putdata(image.convert('L').getdata())
-    
-    result = Image.composite(gradient_image, image, mask)
-    return result
+def encoded_result_id(result_id, format_type, profile, lossless):
+    return BlobStore.content_id(f"{result_id}.{format_type}.{profile}.{lossless}".encode())
+
+def store_result(result_bytes, encoded, settings):
+    """Store a result PNG and return its id
+
+    An encode made for the response is kept too, so downloading the
+    result in the same format and profile does not encode it again.
+    """
+    result_id = result_store.put(result_bytes)
+    if encoded is not None:
+        lossless = bool(settings.get('lossless', False))
+        encoded_results.put(encoded.data, encoded_result_id(result_id, encoded.format, encoded.profile, lossless))
+    return result_id
+
+def run_traced_job(image_bytes, settings, output_format="PNG"):
+    """run_process_job under the stack sampler
+
+    The trace is written to PROFILE_TRACE_DIR by the worker; the summary
+    is returned as a fourth element with the trace id.
+    """
+    (result_bytes, encoded, timings), sampler = profiled(
+        run_process_job, image_bytes, settings, None, output_format,
+        interval=PROFILE_INTERVAL_MS / 1000
+    )
+    recorded = {key: value for key, value in settings.items() if not isinstance(value, bytes)}
+    trace_id = write_trace(PROFILE_TRACE_DIR, sampler, {'settings': recorded, 'timings': timings})
+    return result_bytes, encoded, timings, dict(sampler.summary(), trace_id=trace_id)
+
+def run_preview_job(image_bytes, settings):
+    """Standard quality cutout of a downscaled copy, encoded for speed"""
+    image = Image.open(BytesIO(image_bytes))
+    # Let the JPEG decoder skip most of the work for large photos
+    image.draft('RGB', (PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE))
+    from pipeline import prepare_image
+    image = prepare_image(image)
+    image.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE), Image.BILINEAR)
+
+    preview_settings = dict(settings, quality="Standard", upscale_small=False)
+    result = process_image(image, preview_settings)
+    if result.image is None:
+        return None
+    return encoders.encode(result.image, "PNG", "fast").data
 
 @app.post("/api/process")
-async def process(request: ProcessRequest):
+async def process(request: ProcessRequest, http_request: Request, trace: bool = False):
     try:
         image_data = request.image
         settings = request.settings or {}
+        check_settings(settings)
+        if trace:
+            check_trace_access(http_request)
         
         # Validate image data format
         if not image_data.startswith('data:image/'):
@@ -250,54 +436,566 @@ async def process(request: ProcessRequest):
 
         try:
             # Decode base64 image
+            started = time.perf_counter()
             image_bytes = base64.b64decode(image_data.split(',')[1])
-            image = Image.open(BytesIO(image_bytes))
-            
-            if image is None:
-                raise HTTPException(
-                    status_code=400,
-                    detail='Failed to load image'
-                )
+            decode_ms = (time.perf_counter() - started) * 1000
 
-            # Process image
-            result = process_image(image, settings)
-            
-            if result is None:
-                raise HTTPException(
-                    status_code=500,
-                    detail='Failed to process image'
-                )
+            # Process image on the worker pool
+            report = None
+            started = time.perf_counter()
+            with observe_request("process", settings) as observation:
+                if trace:
+                    result_bytes, encoded, timings, report = await inference_pool.run(run_traced_job, image_bytes, settings)
+                else:
+                    result_bytes, encoded, timings = await inference_pool.run(run_process_job, image_bytes, settings)
+                observation['timings'] = timings
+                # Raised inside the block so the request is counted as an error
+                if result_bytes is None:
+                    raise HTTPException(
+                        status_code=500,
+                        detail='Failed to process image'
+                    )
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            # Keep the result so downloads can reference it by id
+            result_id = store_result(result_bytes, encoded, settings)
 
             # Convert result to base64
-            buffered = BytesIO()
-            result.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            img_str = base64.b64encode(encoded.data if encoded is not None else result_bytes).decode()
             
-            return JSONResponse({
+            content = {
                 'success': True,
-                'image': f'data:image/png;base64,{img_str}'
-            })
+                'image': f'data:image/png;base64,{img_str}',
+                'result_id': result_id,
+                'timings': timings
+            }
+            if report is not None:
+                content['trace'] = report
+            return JSONResponse(
+                content,
+                headers={"Server-Timing": server_timing(timings, decode_ms, elapsed_ms)}
+            )
         
+        except (HTTPException, PoolFullError):
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500,
                 detail=f'Error processing image: {str(e)}'
             )
     
-    except HTTPException as he:
-        raise he
+    except (HTTPException, PoolFullError):
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f'Server error: {str(e)}'
         )
 
+# Form fields and query parameters arrive as strings; coerce them to the
+# types of the pipeline settings schema, plus the API's own options
+SETTING_TYPES = {
+    key: setting_type
+    for key, (setting_type, _) in SETTINGS_SCHEMA.items()
+    if setting_type is not bytes
+}
+SETTING_TYPES.update({
+    'profile': str,
+    'lossless': bool,
+    'preview': bool,
+})
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def parse_settings(fields):
+    """Build a settings dict from string form fields or query parameters"""
+    settings = {}
+    for key, value in fields.items():
+        setting_type = SETTING_TYPES.get(key)
+        if setting_type is None or not isinstance(value, str):
+            continue
+        try:
+            settings[key] = coerce_setting(setting_type, value)
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail=f'Invalid value for {key}: {value}'
+            )
+    return settings
+
+def check_settings(settings):
+    """Reject settings that would only fail once the job is running
+
+    Also swaps a stored `bg_image_id` for its bytes, so workers in another
+    process do not need access to the background store.
+    """
+    try:
+        session_registry.resolve(settings.get('model'))
+        validate_settings(settings)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+    if settings.get('profile', encoders.DEFAULT_PROFILE) not in encoders.PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown encoding profile: {settings.get('profile')}"
+        )
+
+    bg_image_id = settings.get('bg_image_id')
+    if bg_image_id:
+        bg_image_bytes = background_store.get(bg_image_id)
+        if bg_image_bytes is None:
+            raise HTTPException(
+                status_code=400,
+                detail='Unknown or expired background id, please upload it again'
+            )
+        settings['bg_image_bytes'] = bg_image_bytes
+
+    # /api/process sends the background as a base64 data URL
+    bg_image = settings.pop('bg_image', None)
+    if settings.get('background_type') == "Image" and 'bg_image_bytes' not in settings:
+        if not isinstance(bg_image, str) or not bg_image.startswith('data:image/'):
+            raise HTTPException(
+                status_code=400,
+                detail='Error applying background image: Invalid background image data'
+            )
+        settings['bg_image_bytes'] = base64.b64decode(bg_image.split(',')[1])
+
+def iter_chunks(data):
+    for start in range(0, len(data), STREAM_CHUNK_SIZE):
+        yield data[start:start + STREAM_CHUNK_SIZE]
+
+async def read_process_input(request):
+    """Read the image bytes and settings of a binary process request"""
+    content_type = request.headers.get('content-type', '')
+    settings = parse_settings(request.query_params)
+
+    if content_type.startswith('multipart/form-data'):
+        form = await request.form()
+        upload = form.get('image')
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(
+                status_code=400,
+                detail='Missing image file'
+            )
+        image_bytes = await upload.read()
+        settings.update(parse_settings(form))
+
+        bg_upload = form.get('bg_image')
+        if bg_upload is not None and not isinstance(bg_upload, str):
+            settings['bg_image_bytes'] = await bg_upload.read()
+    elif content_type.startswith('image/'):
+        image_bytes = await request.body()
+    else:
+        raise HTTPException(
+            status_code=415,
+            detail='Expected multipart/form-data or an image/* body'
+        )
+
+    if not image_bytes:
+        raise HTTPException(
+            status_code=400,
+            detail='Empty image upload'
+        )
+
+    check_settings(settings)
+    return image_bytes, settings
+
+@app.post("/api/backgrounds", status_code=201)
+async def upload_background(request: Request):
+    """Store a background image once and return its content id"""
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('multipart/form-data'):
+        form = await request.form()
+        upload = form.get('image')
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(
+                status_code=400,
+                detail='Missing image file'
+            )
+        data = await upload.read()
+    elif content_type.startswith('image/'):
+        data = await request.body()
+    else:
+        raise HTTPException(
+            status_code=415,
+            detail='Expected multipart/form-data or an image/* body'
+        )
+
+    try:
+        with Image.open(BytesIO(data)) as bg_image:
+            width, height = bg_image.size
+            bg_image.verify()
+    except Exception:
+        raise HTTPException(
+            status_code=400,
+            detail='Invalid background image'
+        )
+
+    bg_image_id = background_store.put(data)
+    return {'id': bg_image_id, 'width': width, 'height': height}
+
+@app.post("/api/v2/process")
+async def process_v2(request: Request):
+    """Binary variant of /api/process: multipart or raw image body in, PNG out"""
+    image_bytes, settings = await read_process_input(request)
+
+    output_format = encoders.normalize_format(
+        request.query_params.get('format') or encoders.negotiate(
+            request.headers.get('accept'),
+            profile=settings.get('profile', encoders.DEFAULT_PROFILE)
+        )
+    )
+    if output_format not in encoders.supported_formats():
+        raise HTTPException(
+            status_code=400,
+            detail=f'Unsupported format: {output_format}'
+        )
+
+    started = time.perf_counter()
+    try:
+        with observe_request("process_v2", settings) as observation:
+            result_bytes, encoded, observation['timings'] = await inference_pool.run(
+                run_process_job, image_bytes, settings, None, output_format
+            )
+            if result_bytes is None:
+                raise HTTPException(
+                    status_code=500,
+                    detail='Failed to process image'
+                )
+    except (HTTPException, PoolFullError):
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error processing image: {str(e)}'
+        )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    result_id = store_result(result_bytes, encoded, settings)
+    data = encoded.data if encoded is not None else result_bytes
+    return StreamingResponse(
+        iter_chunks(data),
+        media_type=encoders.FORMATS[output_format][0],
+        headers={
+            "Content-Length": str(len(data)),
+            "X-Result-Id": result_id,
+            "Vary": "Accept",
+            "Server-Timing": server_timing(observation['timings'], elapsed_ms=elapsed_ms)
+        }
+    )
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(request: Request):
+    """Queue a processing job and return its id without waiting for the result"""
+    image_bytes, settings = await read_process_input(request)
+    preview = settings.pop('preview', False)
+    job = job_store.create()
+
+    # The preview is submitted first so it reaches a worker ahead of (or
+    # alongside) the full resolution run
+    if preview:
+        def on_preview(future):
+            try:
+                preview_bytes = future.result()
+            except Exception:
+                # The full result still arrives; the preview is best effort
+                return
+            if preview_bytes is not None:
+                job_store.set_preview(job, preview_bytes)
+
+        try:
+            preview_future = inference_pool.submit(run_preview_job, image_bytes, settings)
+        except PoolFullError:
+            job_store.discard(job.id)
+            raise
+        preview_future.add_done_callback(on_preview)
+        job.futures.append(preview_future)
+
+    # Progress callbacks cannot cross a process boundary, so process pools
+    # only report queued/done
+    progress = None
+    if inference_pool.kind == "thread":
+        progress = lambda percent, stage: job_store.update(job, percent, stage)
+
+    try:
+        future = inference_pool.submit(run_process_job, image_bytes, settings, progress)
+    except PoolFullError:
+        # The job is discarded, so its preview would only waste a worker
+        job_store.cancel(job)
+        job_store.discard(job.id)
+        record_request("jobs", settings, "rejected", 0.0)
+        raise
+    job.futures.append(future)
+
+    def on_done(future):
+        if job.status == "cancelled":
+            record_request("jobs", settings, "cancelled", time.time() - job.created_at)
+            return
+        try:
+            result_bytes, encoded, timings = future.result()
+            if result_bytes is None:
+                record_request("jobs", settings, "error", time.time() - job.created_at)
+                job_store.finish(job, error='Failed to process image')
+            else:
+                record_request("jobs", settings, "ok", time.time() - job.created_at, timings)
+                job_store.finish(
+                    job,
+                    result_id=store_result(result_bytes, encoded, settings),
+                    result_profile=settings.get('profile', encoders.DEFAULT_PROFILE),
+                    timings=timings
+                )
+        except Exception as e:
+            record_request("jobs", settings, "error", time.time() - job.created_at)
+            job_store.finish(job, error=str(e))
+
+    future.add_done_callback(on_done)
+    return job.to_dict()
+
+def get_job_or_404(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Job not found or expired'
+        )
+    return job
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    return get_job_or_404(job_id).to_dict()
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job whose result is no longer wanted
+
+    Queued work is dropped; a running thread worker stops at its next stage.
+    """
+    job = get_job_or_404(job_id)
+    job_store.cancel(job)
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.status == "failed":
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error processing image: {job.error}'
+        )
+    if job.status == "cancelled":
+        raise HTTPException(
+            status_code=409,
+            detail='Job was cancelled'
+        )
+    if job.status != "done":
+        raise HTTPException(
+            status_code=409,
+            detail='Job has not finished yet'
+        )
+    data = await load_result(job.result_id, "PNG", job.result_profile, False)
+    if data is None:
+        raise HTTPException(
+            status_code=410,
+            detail='Job result was evicted, please process the image again'
+        )
+    return StreamingResponse(
+        iter_chunks(data),
+        media_type="image/png",
+        headers={"Content-Length": str(len(data))}
+    )
+
+@app.get("/api/jobs/{job_id}/preview")
+async def job_preview(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.preview is None:
+        raise HTTPException(
+            status_code=409,
+            detail='Preview is not available yet'
+        )
+    return StreamingResponse(
+        iter_chunks(job.preview),
+        media_type="image/png",
+        headers={"Content-Length": str(len(job.preview))}
+    )
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the job's stage until it finishes"""
+    job = get_job_or_404(job_id)
+
+    async def event_stream():
+        last_version = -1
+        while True:
+            if job.version != last_version:
+                last_version = job.version
+                yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.status in FINISHED_STATUSES:
+                break
+            await asyncio.sleep(JOB_EVENT_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+def run_batch_job(files, settings):
+    """Process several images with batched inference and return a ZIP archive"""
+    from pipeline import prepare_image
+    images = [prepare_image(Image.open(BytesIO(data))) for _, data in files]
+
+    # Only run the model on images whose masks are not cached yet
+    model_name = session_registry.resolve(settings.get('model'), settings.get('quality'))
+    keys = [MaskCache.make_key(image_fingerprint(img), model_name) for img in images]
+    masks = [mask_cache.get(key) for key in keys]
+    missing = [i for i, mask in enumerate(masks) if mask is None]
+    if missing:
+        session = session_registry.get(model_name)
+        predicted = predict_masks(session, [images[i] for i in missing], BATCH_SIZE)
+        for i, mask in zip(missing, predicted):
+            masks[i] = mask
+            mask_cache.put(keys[i], mask)
+
+    archive = BytesIO()
+    names = set()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+        for index, ((filename, _), img, mask) in enumerate(zip(files, images, masks)):
+            result = process_image(img, settings, mask=mask).image
+            buffered = BytesIO()
+            result.save(buffered, format="PNG")
+            name = os.path.splitext(os.path.basename(filename))[0] or 'image'
+            if name in names:
+                name = f"{name}_{index}"
+            names.add(name)
+            zf.writestr(f"{name}.png", buffered.getvalue())
+    return archive.getvalue()
+
+@app.post("/api/batch")
+async def process_batch(request: Request):
+    """Process many images with shared settings; returns a ZIP of PNGs"""
+    content_type = request.headers.get('content-type', '')
+    if not content_type.startswith('multipart/form-data'):
+        raise HTTPException(
+            status_code=415,
+            detail='Expected multipart/form-data'
+        )
+
+    form = await request.form()
+    uploads = [upload for upload in form.getlist('images') if not isinstance(upload, str)]
+    if not uploads:
+        raise HTTPException(
+            status_code=400,
+            detail='Missing image files'
+        )
+    if len(uploads) > BATCH_MAX_IMAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f'At most {BATCH_MAX_IMAGES} images per batch'
+        )
+
+    settings = parse_settings(request.query_params)
+    settings.update(parse_settings(form))
+    bg_upload = form.get('bg_image')
+    if bg_upload is not None and not isinstance(bg_upload, str):
+        settings['bg_image_bytes'] = await bg_upload.read()
+    check_settings(settings)
+
+    files = []
+    for index, upload in enumerate(uploads):
+        files.append((upload.filename or f"image_{index}", await upload.read()))
+
+    try:
+        with observe_request("batch", settings):
+            archive_bytes = await inference_pool.run(run_batch_job, files, settings)
+    except PoolFullError:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error processing batch: {str(e)}'
+        )
+
+    return StreamingResponse(
+        iter_chunks(archive_bytes),
+        media_type="application/zip",
+        headers={
+            "Content-Length": str(len(archive_bytes)),
+            "Content-Disposition": 'attachment; filename="processed_images.zip"'
+        }
+    )
+
+def download_response(data, format_type):
+    mime_type, extension, _ = encoders.FORMATS[format_type]
+    return StreamingResponse(
+        iter_chunks(data),
+        media_type=mime_type,
+        headers={
+            "Content-Length": str(len(data)),
+            "Content-Disposition": f'attachment; filename="processed_image.{extension}"'
+        }
+    )
+
+@app.get("/api/results/{result_id}")
+async def get_result(result_id: str, format: str = "PNG", profile: str = encoders.DEFAULT_PROFILE, lossless: bool = False):
+    """Download a stored result, encoding each format and profile once"""
+    format_type = encoders.normalize_format(format)
+    if format_type not in encoders.supported_formats():
+        raise HTTPException(
+            status_code=400,
+            detail=f'Unsupported format: {format}'
+        )
+    if profile not in encoders.PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f'Unknown encoding profile: {profile}'
+        )
+
+    data = await load_result(result_id, format_type, profile, lossless)
+    if data is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Result not found or expired'
+        )
+    return download_response(data, format_type)
+
+async def load_result(result_id, format_type, profile, lossless):
+    """A stored result encoded as requested, or None once it was evicted"""
+    png_bytes = result_store.get(result_id)
+    if png_bytes is None:
+        return None
+
+    # The stored result already is a default profile PNG
+    if format_type == "PNG" and profile == encoders.DEFAULT_PROFILE:
+        return png_bytes
+
+    encoded_id = encoded_result_id(result_id, format_type, profile, lossless)
+    data = encoded_results.get(encoded_id)
+    if data is None:
+        try:
+            encoded = await asyncio.to_thread(
+                lambda: encoders.encode(Image.open(BytesIO(png_bytes)), format_type, profile, lossless)
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f'Error saving image: {str(e)}'
+            )
+        data = encoded.data
+        encoded_results.put(data, encoded_id)
+    return data
+
 @app.post("/api/download")
 async def download(request: DownloadRequest):
     try:
         # Get image and format from request
         image_data = request.image
-        format_type = request.format
+        format_type = encoders.normalize_format(request.format)
+        if format_type not in encoders.supported_formats():
+            format_type = "TIFF"
         
         # Validate image data format
         if not image_data.startswith('data:image/'):
@@ -311,52 +1009,9 @@ async def download(request: DownloadRequest):
             image_bytes = base64.b64decode(image_data.split(',')[1])
             image = Image.open(BytesIO(image_bytes))
             
-            if image is None:
-                raise HTTPException(
-                    status_code=400,
-                    detail='Failed to load image'
-                )
-            
-            # Create temporary file
-            temp_dir = tempfile.mkdtemp()
-            temp_file_path = os.path.join(temp_dir, f"processed_image.{format_type.lower()}")
-            
-            try:
-                # Save image in specified format
-                if format_type == "PNG":
-                    image.save(temp_file_path, format="PNG", compress_level=0)
-                    mime_type = "image/png"
-                elif format_type == "JPG":
-                    image.convert("RGB").save(temp_file_path, format="JPEG", quality=100, subsampling=0)
-                    mime_type = "image/jpeg"
-                else:  # TIFF
-                    image.save(temp_file_path, format="TIFF", compression="tiff_deflate")
-                    mime_type = "image/tiff"
-                
-                # Clean up temporary directory after response is sent
-                def cleanup():
-                    try:
-                        shutil.rmtree(temp_dir)
-                    except:
-                        pass
-                
-                return FileResponse(
-                    temp_file_path,
-                    media_type=mime_type,
-                    filename=f"processed_image.{format_type.lower()}",
-                    background=cleanup
-                )
-            
-            except Exception as e:
-                # Clean up on error
-                try:
-                    shutil.rmtree(temp_dir)
-                except:
-                    pass
-                raise HTTPException(
-                    status_code=500,
-                    detail=f'Error saving image: {str(e)}'
-                )
+            # Encode in memory; no temporary files to clean up
+            encoded = await asyncio.to_thread(encoders.encode, image, format_type)
+            return download_response(encoded.data, format_type)
         
         except Exception as e:
             raise HTTPException(
@@ -372,7 +1027,59 @@ async def download(request: DownloadRequest):
             detail=f'Server error: {str(e)}'
         )
 
+async def run_warm_up():
+    """Warm every inference worker, then mark the instance ready"""
+    loop = asyncio.get_running_loop()
+    # Thread workers share one pipeline; each worker process has its own
+    runs = inference_pool.max_workers if inference_pool.kind == "process" else 1
+    try:
+        seconds = await asyncio.gather(*[
+            loop.run_in_executor(inference_pool.executor, warm_up) for _ in range(runs)
+        ])
+        readiness.update(status="ready", seconds=round(max(seconds), 2))
+        logger.info("Warm-up finished in %.1f s", max(seconds))
+    except Exception as e:
+        readiness.update(status="failed", error=str(e))
+        logger.error("Warm-up failed: %s", e)
+    logger.info(
+        "Runtime: %s, inference_workers=%d (%s)",
+        ", ".join(f"{key}={value}" for key, value in runtime_report().items()),
+        inference_pool.max_workers, inference_pool.kind
+    )
+
+def start_warm_up():
+    global _warm_up_task
+    if _warm_up_task is None and readiness['status'] == "warming":
+        _warm_up_task = asyncio.get_running_loop().create_task(run_warm_up())
+
+@app.on_event("startup")
+async def warm_up_on_startup():
+    # rembg, pymatting and numba must be imported on the main thread: imported
+    # from a worker thread, interpreter shutdown hangs in garbage collection
+    get_pipeline()
+    # Model loading runs in the background so the server accepts requests
+    # right away
+    if WARMUP_ON_STARTUP:
+        start_warm_up()
+
+@app.on_event("shutdown")
+def shutdown_inference_pool():
+    inference_pool.shutdown()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(content=metrics.render(), media_type=MetricsRegistry.CONTENT_TYPE)
+
 # For Vercel deployment
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy"} 
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/api/ready")
+async def readiness_check():
+    """Readiness probe: 200 once models are loaded and warmed, 503 before"""
+    # Platforms without startup events warm up on the first probe instead
+    start_warm_up()
+    content = dict(readiness, models=session_registry.loaded_models)
+    return JSONResponse(content, status_code=200 if readiness['status'] == "ready" else 503) 
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class BlobStore:
+    """Content-addressed byte store with LRU eviction and an optional disk tier
+
+    Blobs are identified by a hash of their content, so storing the same
+    upload twice returns the same id and costs nothing extra.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if disk_dir and not os.path.exists(disk_dir):
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, prefix, default_mb=256):
+        """Build a store from <prefix>_MB and <prefix>_DIR environment variables"""
+        return cls(
+            max_bytes=int(os.getenv(f"{prefix}_MB", str(default_mb))) * 1024 * 1024,
+            disk_dir=os.getenv(f"{prefix}_DIR") or None,
+        )
+
+    @staticmethod
+    def content_id(data):
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    @staticmethod
+    def valid_id(blob_id):
+        return isinstance(blob_id, str) and len(blob_id) == 32 and all(c in "0123456789abcdef" for c in blob_id)
+
+    def _disk_path(self, blob_id):
+        return os.path.join(self.disk_dir, blob_id)
+
+    def put(self, data, blob_id=None):
+        """Store data and return its id"""
+        blob_id = blob_id or self.content_id(data)
+        self._remember(blob_id, data)
+        if self.disk_dir and not os.path.exists(self._disk_path(blob_id)):
+            tmp_path = self._disk_path(blob_id) + ".tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self._disk_path(blob_id))
+            except OSError:
+                pass
+        return blob_id
+
+    def get(self, blob_id):
+        """Return the stored bytes, or None when unknown or evicted"""
+        if not self.valid_id(blob_id):
+            return None
+        with self._lock:
+            data = self._entries.get(blob_id)
+            if data is not None:
+                self._entries.move_to_end(blob_id)
+                return data
+
+        if self.disk_dir and os.path.exists(self._disk_path(blob_id)):
+            try:
+                with open(self._disk_path(blob_id), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                return None
+            self._remember(blob_id, data)
+            return data
+        return None
+
+    def _remember(self, blob_id, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if blob_id in self._entries:
+                self._entries.move_to_end(blob_id)
+                return
+            self._entries[blob_id] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
@@ -0,0 +1,247 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+from pipeline import SETTINGS_SCHEMA, coerce_setting, validate_settings
+from runtime_config import RuntimeConfig
+from session_registry import SessionRegistry
+import encoders
+
+# Headless batch processing of image directories
+#
+#   python batch_cli.py photos/ "catalog/**/*.jpg" -o out/ --set quality="Ultra HD"
+#
+# Each worker process loads its own model session; the parent never imports
+# rembg or ONNX Runtime, so forking the workers is safe. Results are written
+# as soon as each file finishes, and files whose output already exists are
+# skipped, so an interrupted run resumes where it stopped.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff')
+
+# Set in each worker process by init_worker
+_pipeline = None
+_settings = None
+
+
+def collect_inputs(patterns, recursive=True):
+    """(source path, output path relative to the output directory) pairs,
+    and the patterns that matched no image
+
+    Files found under a directory keep their relative path; files matched
+    by a glob or named directly are placed at the top level.
+    """
+    inputs, unmatched = [], []
+    for pattern in patterns:
+        found = len(inputs)
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                if not recursive:
+                    dirs.clear()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        inputs.append((path, os.path.relpath(path, pattern)))
+        else:
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                    inputs.append((path, os.path.basename(path)))
+        if len(inputs) == found:
+            unmatched.append(pattern)
+    return inputs, unmatched
+
+
+def parse_assignments(assignments):
+    """Settings from KEY=VALUE strings, typed by SETTINGS_SCHEMA"""
+    settings = {}
+    for assignment in assignments:
+        key, sep, value = assignment.partition("=")
+        setting_type = SETTINGS_SCHEMA.get(key, (None,))[0]
+        if not sep or setting_type is None or setting_type is bytes:
+            raise SystemExit(f"Unknown setting: {assignment}")
+        try:
+            settings[key] = coerce_setting(setting_type, value)
+        except ValueError:
+            raise SystemExit(f"Invalid value for {key}: {value}")
+    return settings
+
+
+def init_worker(settings, runtime):
+    """Build this worker's pipeline; caches are skipped as every file is new"""
+    global _pipeline, _settings
+    from pipeline import Pipeline
+    from compositing import BackgroundAssetCache
+
+    runtime.apply_opencv()
+    _pipeline = Pipeline(
+        SessionRegistry.from_env(runtime),
+        masks=None,
+        stage_cache=None,
+        # Keeps the decoded backdrop, which is usually shared by every file
+        background_assets=BackgroundAssetCache.from_env(),
+    )
+    _settings = settings
+
+
+def process_file(source, destination, format_type, profile, lossless):
+    """Process one file and write it atomically; returns (seconds, megapixels)"""
+    started = time.perf_counter()
+    with Image.open(source) as image:
+        megapixels = image.size[0] * image.size[1] / 1e6
+        result = _pipeline.run(image, _settings)
+    encoded = encoders.encode(result.image, format_type, profile, lossless)
+
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    # A file under the final name is always complete, which is what makes
+    # skipping existing outputs safe after an interrupted run
+    partial = f"{destination}.{os.getpid()}.part"
+    with open(partial, "wb") as f:
+        f.write(encoded.data)
+    os.replace(partial, destination)
+    return time.perf_counter() - started, megapixels
+
+
+def output_path(output_dir, relative, format_type):
+    extension = encoders.FORMATS[format_type][1]
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + "." + extension)
+
+
+def worker_runtime(workers):
+    """Thread settings from the environment, split across workers when unset"""
+    runtime = RuntimeConfig.from_env()
+    threads = max((os.cpu_count() or 1) // workers, 1)
+    if not runtime.intra_op_threads:
+        runtime.intra_op_threads = threads
+    if runtime.opencv_threads is None:
+        runtime.opencv_threads = threads
+    return runtime
+
+
+def check_settings(settings):
+    """Exit once for settings every worker would fail on, like the API's 400s"""
+    try:
+        SessionRegistry.from_env().resolve(settings.get('model'))
+        validate_settings(settings)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if settings.get('background_type') == "Image":
+        if not settings.get('bg_image_bytes'):
+            raise SystemExit("background_type=Image needs --bg-image")
+        try:
+            with Image.open(BytesIO(settings['bg_image_bytes'])) as background:
+                background.verify()
+        except Exception:
+            raise SystemExit("The background image cannot be read")
+
+
+def run(args):
+    settings = {}
+    if args.settings:
+        with open(args.settings) as f:
+            settings.update(json.load(f))
+    settings.update(parse_assignments(args.set))
+    if args.bg_image:
+        with open(args.bg_image, "rb") as f:
+            settings['bg_image_bytes'] = f.read()
+        settings.setdefault('background_type', "Image")
+    check_settings(settings)
+
+    inputs, unmatched = collect_inputs(args.inputs, not args.no_recursive)
+    for pattern in unmatched:
+        print(f"WARNING {pattern}: no images found", file=sys.stderr)
+    if not inputs:
+        # Most likely a mistyped path, which must not look like a finished run
+        print("No input images found", file=sys.stderr)
+        return 2
+
+    pending, skipped, seen = [], 0, {}
+    for source, relative in inputs:
+        destination = output_path(args.output, relative, args.format)
+        if destination in seen:
+            # The same file matched by several inputs is only processed once
+            if os.path.abspath(seen[destination]) != os.path.abspath(source):
+                print(f"SKIP {source}: {seen[destination]} already writes {destination}", file=sys.stderr)
+            continue
+        seen[destination] = source
+        if os.path.exists(destination) and not args.overwrite:
+            skipped += 1
+            continue
+        pending.append((source, destination))
+
+    print(f"{len(pending)} to process, {skipped} already done, {args.workers} workers", flush=True)
+    if not pending:
+        return 0
+
+    failures = []
+    done = 0
+    megapixels = 0.0
+    started = time.perf_counter()
+    executor = ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_worker,
+        initargs=(settings, worker_runtime(args.workers)),
+    )
+    try:
+        futures = {
+            executor.submit(process_file, source, destination, args.format, args.profile, args.lossless): source
+            for source, destination in pending
+        }
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                seconds, size = future.result()
+            except Exception as e:
+                failures.append((source, str(e)))
+                print(f"FAIL {source}: {e}", file=sys.stderr, flush=True)
+                continue
+            done += 1
+            megapixels += size
+            if not args.quiet:
+                print(f"[{done + len(failures)}/{len(pending)}] {source} ({seconds:.1f} s)", flush=True)
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        print("Interrupted; rerun the same command to resume", file=sys.stderr)
+        return 130
+    executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Processed {done} images ({megapixels:.1f} MP) in {elapsed:.1f} s: "
+        f"{done / elapsed:.2f} images/s, {megapixels / elapsed:.2f} MP/s; "
+        f"{skipped} skipped, {len(failures)} failed"
+    )
+    for source, error in failures:
+        print(f"  {source}: {error}")
+    return 1 if failures else 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Remove backgrounds from many images")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="pipeline setting as sent to /api/process, e.g. quality=\"Ultra HD\" (repeatable)")
+    parser.add_argument("--settings", help="JSON file of settings, applied before --set")
+    parser.add_argument("--bg-image", help="background image file (implies background_type=Image)")
+    parser.add_argument("--format", type=encoders.normalize_format, default="PNG",
+                        choices=encoders.supported_formats())
+    parser.add_argument("--profile", default=encoders.DEFAULT_PROFILE, choices=list(encoders.PROFILES))
+    parser.add_argument("--lossless", action="store_true", help="lossless WebP/AVIF")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--overwrite", action="store_true", help="reprocess files whose output exists")
+    parser.add_argument("--no-recursive", action="store_true", help="do not descend into subdirectories")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print failures and the summary")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
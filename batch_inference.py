@@ -0,0 +1,53 @@
+import numpy as np
+from PIL import Image
+
+# Input normalization (mean, std, size) used by rembg's predict() for each model
+MODEL_INPUTS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+
+def _max_batch(session, batch_size):
+    """Largest batch the model's input accepts; exported graphs may fix it to 1"""
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    if isinstance(batch_dim, int) and batch_dim > 0:
+        return min(batch_dim, batch_size)
+    return batch_size
+
+
+def predict_masks(session, images, batch_size=8):
+    """Predict raw masks for several images with one ONNX run per batch
+
+    Produces the same masks as calling session.predict() on each image, but
+    stacks the normalized inputs into a single tensor. Models without a
+    known input layout fall back to one predict() call per image.
+    """
+    model_inputs = MODEL_INPUTS.get(getattr(session, "model_name", None))
+    if model_inputs is None or not hasattr(session, "inner_session"):
+        return [session.predict(img)[0] for img in images]
+
+    mean, std, size = model_inputs
+    input_name = session.inner_session.get_inputs()[0].name
+    batch_size = _max_batch(session, batch_size)
+
+    masks = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        batch = np.concatenate(
+            [session.normalize(img, mean, std, size)[input_name] for img in chunk],
+            axis=0,
+        )
+        preds = session.inner_session.run(None, {input_name: batch})[0][:, 0, :, :]
+
+        for pred, img in zip(preds, chunk):
+            # Normalize per image, as a batch of one would in predict()
+            mi, ma = pred.min(), pred.max()
+            pred = (pred - mi) / max(ma - mi, 1e-6)
+            mask = Image.fromarray((pred.clip(0, 1) * 255).astype(np.uint8))
+            masks.append(mask.resize(img.size, Image.LANCZOS))
+
+    return masks
@@ -0,0 +1,338 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+from io import BytesIO
+import numpy as np
+import cv2
+from PIL import Image
+import PIL
+from session_registry import SessionRegistry
+from runtime_config import RuntimeConfig
+from quantization import split_model_name, quantized_model_path
+from compositing import BackgroundAssetCache
+import gradients
+from pipeline import Pipeline
+from metrics import process_rss_bytes
+import encoders
+
+# Offline benchmark of the processing pipeline
+#
+#   python benchmark.py --output baseline.json
+#   python benchmark.py --compare baseline.json
+#
+# Every run is cold: mask, stage, gradient and background caches are
+# bypassed so the numbers measure the work itself.
+
+SIZES_MP = (0.5, 2, 12, 48)
+SOURCES = ("synthetic", "image1", "image2")
+QUALITIES = ("Standard", "Ultra HD")
+BACKGROUNDS = ("Transparent", "Color", "Gradient", "Image")
+DEFAULT_THRESHOLD = 0.10
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Same ORT_* and OPENCV_THREADS settings as the API, so thread counts can
+# be tuned here before deploying them
+RUNTIME = RuntimeConfig.from_env()
+
+
+class SyntheticSession:
+    """Deterministic stand-in for a segmentation model
+
+    Like the real models it works on a 320 px copy and scales the mask
+    back, so pipeline costs around inference stay realistic, but the
+    network itself costs nothing. Used when no model file is on disk.
+    """
+
+    model_name = "synthetic"
+
+    def predict(self, img, *args, **kwargs):
+        small = np.asarray(img.convert('RGB').resize((320, 320), Image.BILINEAR)).astype(np.float32)
+        border = np.concatenate([small[0], small[-1], small[:, 0], small[:, -1]])
+        distance = np.linalg.norm(small - border.mean(axis=0), axis=2)
+        mask = (distance > distance.mean()).astype(np.uint8) * 255
+        mask = cv2.GaussianBlur(mask, (9, 9), 0)
+        return [Image.fromarray(mask).resize(img.size, Image.BILINEAR)]
+
+
+def model_available(model_name):
+    base, quantized = split_model_name(model_name)
+    if quantized:
+        return os.path.exists(quantized_model_path(base))
+    home = os.path.expanduser(os.getenv("U2NET_HOME", os.path.join("~", ".u2net")))
+    return os.path.exists(os.path.join(home, f"{model_name}.onnx"))
+
+
+def make_sessions(model_name):
+    if model_name == "synthetic":
+        return SessionRegistry(default_model="u2net", factory=lambda name: SyntheticSession())
+    if not model_available(model_name):
+        raise SystemExit(f"Model {model_name} is not downloaded; use --models synthetic to run offline")
+    return SessionRegistry(default_model=model_name, runtime=RUNTIME)
+
+
+def synthetic_image(width, height, seed=0):
+    """Textured backdrop with a smooth subject in the middle"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    backdrop = np.stack([
+        120 + 60 * np.sin(x / max(width, 1) * 6.0),
+        140 + 40 * np.cos(y / max(height, 1) * 4.0),
+        np.full((height, width), 180, np.float32),
+    ], axis=2)
+    subject = ((x - width / 2) / (width * 0.3)) ** 2 + ((y - height / 2) / (height * 0.4)) ** 2 < 1.0
+    backdrop[subject] = (200, 90, 60)
+    noise = rng.normal(0, 8, (height, width, 1)).astype(np.float32)
+    return Image.fromarray(np.clip(backdrop + noise, 0, 255).astype(np.uint8))
+
+
+def sized(width, height, megapixels):
+    scale = (megapixels * 1e6 / (width * height)) ** 0.5
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def load_source(name, megapixels):
+    if name == "synthetic":
+        return synthetic_image(*sized(4, 3, megapixels))
+    with Image.open(os.path.join(HERE, f"{name}.png")) as image:
+        image = image.convert('RGB')
+        return image.resize(sized(image.size[0], image.size[1], megapixels), Image.LANCZOS)
+
+
+def backdrop_bytes():
+    buffered = BytesIO()
+    synthetic_image(1600, 1200, seed=1).save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+
+def background_settings(background, bg_bytes):
+    if background == "Color":
+        return {'background_type': "Color", 'bg_color': "#336699"}
+    if background == "Gradient":
+        return {'background_type': "Gradient", 'gradient_mode': "angled", 'gradient_angle': 30}
+    if background == "Image":
+        return {'background_type': "Image", 'bg_image_bytes': bg_bytes}
+    return {'background_type': "Transparent"}
+
+
+def summarize(samples_ms, megapixels, peak_bytes=None, stages=None):
+    samples = np.array(samples_ms)
+    mean_s = samples.mean() / 1000
+    return {
+        "runs": len(samples_ms),
+        "p50_ms": round(float(np.percentile(samples, 50)), 2),
+        "p90_ms": round(float(np.percentile(samples, 90)), 2),
+        "p99_ms": round(float(np.percentile(samples, 99)), 2),
+        "max_ms": round(float(samples.max()), 2),
+        "images_per_s": round(1 / mean_s, 3) if mean_s else None,
+        "megapixels_per_s": round(megapixels / mean_s, 3) if mean_s else None,
+        "peak_bytes": peak_bytes,
+        "stages_p50_ms": stages or {},
+    }
+
+
+def release_free_memory():
+    """Hand freed heap pages back to the OS so they do not hide the next peak"""
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def sampled_peak(func, interval=0.002):
+    """Peak resident memory growth during one call, in bytes
+
+    RSS is polled from a background thread, so Pillow's buffers count
+    along with NumPy and OpenCV arrays; allocations living for less than
+    `interval` can be missed. None when RSS cannot be read.
+    """
+    release_free_memory()
+    base = process_rss_bytes()
+    if base is None:
+        return None
+    peak = [base]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak[0] = max(peak[0], process_rss_bytes())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        func()
+    finally:
+        done.set()
+        sampler.join()
+    peak[0] = max(peak[0], process_rss_bytes())
+    return max(peak[0] - base, 0)
+
+
+def run_benchmarks(args):
+    bg_bytes = backdrop_bytes()
+    results = {}
+
+    for model_name in args.models:
+        pipeline = Pipeline(
+            make_sessions(model_name),
+            masks=None,
+            stage_cache=None,
+            # A zero budget keeps nothing, so every run decodes and resizes
+            background_assets=BackgroundAssetCache(max_bytes=0),
+        )
+
+        for source in args.sources:
+            for megapixels in args.sizes:
+                image = load_source(source, megapixels)
+                transparent_result = None
+
+                for quality in args.qualities:
+                    for background in args.backgrounds:
+                        settings = {'quality': quality, 'model': None if model_name == "synthetic" else model_name}
+                        settings.update(background_settings(background, bg_bytes))
+
+                        def run():
+                            gradients.clear_cache()
+                            return pipeline.run(image, settings)
+
+                        for _ in range(args.warmup):
+                            run()
+                        samples, stage_samples = [], {}
+                        for _ in range(args.repeat):
+                            started = time.perf_counter()
+                            result = run()
+                            samples.append((time.perf_counter() - started) * 1000)
+                            for timing in result.timings:
+                                stage_samples.setdefault(timing.name, []).append(timing.wall_ms)
+                        if background == "Transparent":
+                            transparent_result = result.image
+
+                        peak = None if args.no_memory else sampled_peak(run)
+                        stages = {
+                            name: round(float(np.median(values)), 2)
+                            for name, values in stage_samples.items()
+                        }
+                        case = f"{source}@{megapixels}MP/{quality}/{background}/{model_name}"
+                        results[case] = summarize(samples, megapixels, peak, stages)
+                        report(case, results[case])
+
+                if transparent_result is None:
+                    continue
+                for format_type in args.formats:
+                    for profile in args.profiles:
+                        def encode():
+                            return encoders.encode(transparent_result, format_type, profile)
+
+                        for _ in range(args.warmup):
+                            encode()
+                        samples = []
+                        for _ in range(args.repeat):
+                            encoded = encode()
+                            samples.append(encoded.seconds * 1000)
+                        peak = None if args.no_memory else sampled_peak(encode)
+                        case = f"{source}@{megapixels}MP/encode/{format_type}/{profile}"
+                        results[case] = summarize(samples, megapixels, peak)
+                        results[case]["bytes"] = len(encoded.data)
+                        report(case, results[case])
+
+    return results
+
+
+def report(case, stats):
+    peak = f"{stats['peak_bytes'] / 2**20:9.1f} MB" if stats['peak_bytes'] is not None else "        -"
+    print(
+        f"{case:<55} p50 {stats['p50_ms']:9.1f} ms  p90 {stats['p90_ms']:9.1f} ms  "
+        f"{stats['images_per_s']:8.2f} img/s  peak {peak}",
+        flush=True
+    )
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "opencv": cv2.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "runtime": RUNTIME.report(),
+    }
+
+
+def compare(baseline, current, threshold, memory_threshold):
+    """Cases that got slower (p50) or bigger (peak memory) than allowed"""
+    regressions = []
+    for case, stats in current.items():
+        before = baseline.get(case)
+        if before is None:
+            continue
+        if before["p50_ms"] > 0:
+            ratio = stats["p50_ms"] / before["p50_ms"]
+            if ratio > 1 + threshold:
+                regressions.append((case, "p50_ms", before["p50_ms"], stats["p50_ms"], ratio))
+        if before.get("peak_bytes") and stats.get("peak_bytes") is not None:
+            ratio = stats["peak_bytes"] / before["peak_bytes"]
+            if ratio > 1 + memory_threshold:
+                regressions.append((case, "peak_bytes", before["peak_bytes"], stats["peak_bytes"], ratio))
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the background removal pipeline offline")
+    parser.add_argument("--sizes", type=float, nargs="+", default=list(SIZES_MP), help="image sizes in megapixels")
+    parser.add_argument("--sources", nargs="+", default=list(SOURCES), choices=SOURCES)
+    parser.add_argument("--qualities", nargs="+", default=list(QUALITIES), choices=QUALITIES)
+    parser.add_argument("--backgrounds", nargs="+", default=list(BACKGROUNDS), choices=BACKGROUNDS)
+    parser.add_argument("--formats", nargs="+", type=encoders.normalize_format,
+                        default=encoders.supported_formats(), choices=encoders.supported_formats())
+    parser.add_argument("--profiles", nargs="+", default=[encoders.DEFAULT_PROFILE], choices=list(encoders.PROFILES))
+    parser.add_argument("--models", nargs="+", default=None,
+                        help="models to run; defaults to u2net when downloaded, otherwise synthetic")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra memory-sampled run per case")
+    parser.add_argument("--output", help="write results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed p50 slowdown before failing (0.10 = 10%%)")
+    parser.add_argument("--memory-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed peak memory growth before failing")
+    args = parser.parse_args(argv)
+    if args.models is None:
+        args.models = ["u2net"] if model_available("u2net") else ["synthetic"]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    RUNTIME.apply_opencv()
+    print(f"Runtime: {RUNTIME.describe()}", flush=True)
+    results = run_benchmarks(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "cases": results}, f, indent=2)
+        print(f"Wrote {len(results)} cases to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline["cases"], results, args.threshold, args.memory_threshold)
+        matched = sum(1 for case in results if case in baseline["cases"])
+        print(f"Compared {matched} cases against {args.compare}")
+        for case, metric, before, after, ratio in regressions:
+            print(f"REGRESSION {case} {metric}: {before} -> {after} ({(ratio - 1) * 100:+.1f}%)")
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import sys
+import time
+from io import BytesIO
+from PIL import Image
+
+# Output formats: mime type, file extension and whether alpha survives
+FORMATS = {
+    "PNG": ("image/png", "png", True),
+    "WEBP": ("image/webp", "webp", True),
+    "AVIF": ("image/avif", "avif", True),
+    "JPG": ("image/jpeg", "jpg", False),
+    "TIFF": ("image/tiff", "tiff", True),
+}
+
+# Pillow save options per profile and format. fast trades size for CPU,
+# smallest spends CPU for bandwidth; balanced sits in between.
+PROFILES = {
+    "fast": {
+        "PNG": {"compress_level": 1},
+        "WEBP": {"quality": 90, "method": 0},
+        "AVIF": {"quality": 80, "speed": 10},
+        "JPG": {"quality": 90},
+        "TIFF": {},
+    },
+    "balanced": {
+        "PNG": {"compress_level": 6},
+        "WEBP": {"quality": 90, "method": 4},
+        "AVIF": {"quality": 75, "speed": 6},
+        "JPG": {"quality": 92, "subsampling": 0},
+        "TIFF": {"compression": "tiff_deflate"},
+    },
+    "smallest": {
+        "PNG": {"compress_level": 9, "optimize": True},
+        "WEBP": {"quality": 80, "method": 6},
+        "AVIF": {"quality": 60, "speed": 4},
+        "JPG": {"quality": 85, "optimize": True, "progressive": True},
+        "TIFF": {"compression": "tiff_deflate"},
+    },
+}
+
+DEFAULT_PROFILE = "balanced"
+
+# Server preference when the client accepts several formats equally.
+# Browsers list AVIF first in Accept, but it is by far the slowest encoder,
+# so it is only preferred for the `smallest` profile
+NEGOTIATION_ORDER = ("WEBP", "PNG", "JPG", "TIFF", "AVIF")
+SMALLEST_NEGOTIATION_ORDER = ("AVIF", "WEBP", "PNG", "JPG", "TIFF")
+
+
+def supported_formats():
+    """Formats this Pillow build can write"""
+    Image.init()
+    pillow_names = {"JPG": "JPEG"}
+    return [name for name in FORMATS if pillow_names.get(name, name) in Image.SAVE]
+
+
+class EncodeResult:
+    """Encoded bytes plus what it took to produce them"""
+
+    def __init__(self, data, format_type, profile, seconds):
+        self.data = data
+        self.format = format_type
+        self.profile = profile
+        self.seconds = seconds
+
+    @property
+    def mime_type(self):
+        return FORMATS[self.format][0]
+
+    @property
+    def extension(self):
+        return FORMATS[self.format][1]
+
+
+def normalize_format(format_type):
+    format_type = (format_type or "PNG").upper()
+    return {"JPEG": "JPG", "TIF": "TIFF"}.get(format_type, format_type)
+
+
+def encode(image, format_type="PNG", profile=DEFAULT_PROFILE, lossless=False):
+    """Encode image with a named profile and return an EncodeResult
+
+    `lossless` applies to WebP and AVIF, which are lossy by default.
+    """
+    format_type = normalize_format(format_type)
+    if format_type not in FORMATS:
+        raise ValueError(f"Unsupported format: {format_type}")
+    if format_type not in supported_formats():
+        raise ValueError(f"{format_type} is not supported by this server")
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown encoding profile: {profile}")
+
+    options = dict(PROFILES[profile][format_type])
+    if lossless and format_type in ("WEBP", "AVIF"):
+        options["lossless"] = True
+        if format_type == "WEBP":
+            # Quality sets compression effort for lossless WebP
+            options["quality"] = {"fast": 0, "balanced": 50, "smallest": 100}[profile]
+
+    if not FORMATS[format_type][2] and image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGB")
+
+    start = time.perf_counter()
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG" if format_type == "JPG" else format_type, **options)
+    return EncodeResult(buffered.getvalue(), format_type, profile, time.perf_counter() - start)
+
+
+def negotiate(accept_header, default="PNG", profile=DEFAULT_PROFILE):
+    """Pick an output format from an HTTP Accept header
+
+    Exact image types win over wildcards at the same q-value, and ties go
+    to NEGOTIATION_ORDER (SMALLEST_NEGOTIATION_ORDER for the `smallest`
+    profile). Wildcards alone keep `default`.
+    """
+    order = SMALLEST_NEGOTIATION_ORDER if profile == "smallest" else NEGOTIATION_ORDER
+    available = supported_formats()
+    mime_to_format = {FORMATS[name][0]: name for name in available}
+
+    best = None
+    for part in (accept_header or "").split(","):
+        fields = [field.strip() for field in part.split(";")]
+        media_type = fields[0].lower()
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q <= 0:
+            continue
+
+        format_type = mime_to_format.get(media_type)
+        if format_type is None:
+            if media_type in ("image/*", "*/*"):
+                candidate = (q, 0, 0, default)
+            else:
+                continue
+        else:
+            rank = len(order) - order.index(format_type)
+            candidate = (q, 1, rank, format_type)
+        if best is None or candidate[:3] > best[:3]:
+            best = candidate
+
+    return best[3] if best else default
+
+
+def benchmark(image, repeat=3):
+    """Encode image with every supported format and profile
+
+    Returns rows of (format, profile, median milliseconds, bytes) so the
+    CPU versus bandwidth trade-off can be compared on real outputs.
+    """
+    rows = []
+    for format_type in supported_formats():
+        for profile in PROFILES:
+            timings = []
+            for _ in range(repeat):
+                result = encode(image, format_type, profile)
+                timings.append(result.seconds)
+            timings.sort()
+            rows.append((format_type, profile, timings[len(timings) // 2] * 1000, len(result.data)))
+    return rows
+
+
+if __name__ == "__main__":
+    # python encoders.py image.png
+    with Image.open(sys.argv[1]) as source:
+        source.load()
+        print(f"{'format':<6} {'profile':<9} {'ms':>9} {'bytes':>12}")
+        for format_type, profile, ms, size in benchmark(source):
+            print(f"{format_type:<6} {profile:<9} {ms:>9.1f} {size:>12,}")
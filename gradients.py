@@ -0,0 +1,95 @@
+import os
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageColor
+from compositing import composite
+
+GRADIENT_MODES = ("linear", "radial", "angled")
+
+# Rendered gradients, least recently used first; a 24 MP gradient alone
+# is about 70 MB, so the cache is bounded by size rather than entries
+GRADIENT_CACHE_BYTES = int(os.getenv("GRADIENT_CACHE_MB", "128")) * 1024 * 1024
+_cache = OrderedDict()
+_cache_size = 0
+_cache_lock = threading.Lock()
+
+
+def gradient_array(size, start_color, end_color, mode="linear", angle=0):
+    """Full resolution gradient as a read-only (height, width, 3) uint8 array
+
+    linear runs left to right, radial from the center outwards and angled
+    along `angle` degrees (0 = left to right, 90 = top to bottom). Results
+    are cached by (size, colors, mode, angle) up to GRADIENT_CACHE_MB.
+    """
+    global _cache_size
+    if mode not in GRADIENT_MODES:
+        raise ValueError(f"Unknown gradient mode: {mode}")
+    key = (tuple(size), start_color, end_color, mode, angle if mode == "angled" else 0)
+    with _cache_lock:
+        gradient = _cache.get(key)
+        if gradient is not None:
+            _cache.move_to_end(key)
+            return gradient
+
+    gradient = render_gradient(*key)
+
+    with _cache_lock:
+        if gradient.nbytes <= GRADIENT_CACHE_BYTES and key not in _cache:
+            _cache[key] = gradient
+            _cache_size += gradient.nbytes
+            while _cache_size > GRADIENT_CACHE_BYTES:
+                _, evicted = _cache.popitem(last=False)
+                _cache_size -= evicted.nbytes
+    return gradient
+
+
+def clear_cache():
+    global _cache_size
+    with _cache_lock:
+        _cache.clear()
+        _cache_size = 0
+
+
+def render_gradient(size, start_color, end_color, mode, angle):
+    """Uncached gradient_array"""
+    width, height = size
+    start = np.array(ImageColor.getrgb(start_color)[:3], dtype=np.float32)
+    end = np.array(ImageColor.getrgb(end_color)[:3], dtype=np.float32)
+
+    x = np.linspace(0.0, 1.0, width, dtype=np.float32)[np.newaxis, :]
+    y = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, np.newaxis]
+
+    if mode == "linear":
+        t = np.repeat(x, height, axis=0)
+    elif mode == "radial":
+        # Distance from the center, normalized so the corners reach 1
+        t = np.sqrt((x - 0.5) ** 2 * width ** 2 + (y - 0.5) ** 2 * height ** 2)
+        t /= max(math.hypot(width, height) / 2.0, 1e-6)
+    else:
+        # Project pixel coordinates on the gradient direction
+        radians = math.radians(angle)
+        dx, dy = math.cos(radians), math.sin(radians)
+        t = (x * (width - 1)) * dx + (y * (height - 1)) * dy
+        t = t - t.min()
+        t /= max(float(t.max()), 1e-6)
+
+    # Quantize to 256 steps and look colors up in a table instead of
+    # interpolating three float channels for every pixel
+    lut = (start + (end - start) * np.linspace(0.0, 1.0, 256, dtype=np.float32)[:, np.newaxis])
+    lut = lut.round().astype(np.uint8)
+    index = (np.clip(t, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+    gradient = lut[index]
+    gradient.setflags(write=False)
+    return gradient
+
+
+def gradient_image(size, start_color, end_color, mode="linear", angle=0):
+    """Gradient as an RGB PIL image"""
+    return Image.fromarray(gradient_array(tuple(size), start_color, end_color, mode, angle))
+
+
+def apply_gradient_background(image, start_color, end_color, mode="linear", angle=0):
+    """Composite the image over a gradient using its alpha channel"""
+    return composite(image, gradient_array(tuple(image.size), start_color, end_color, mode, angle))
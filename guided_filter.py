@@ -0,0 +1,77 @@
+import numpy as np
+import cv2
+from PIL import Image
+
+
+def working_size(size, max_pixels):
+    """Largest size with the same aspect ratio and at most max_pixels pixels"""
+    width, height = size
+    if width * height <= max_pixels:
+        return size
+    scale = (max_pixels / float(width * height)) ** 0.5
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def _box(array, radius):
+    return cv2.boxFilter(array, -1, (2 * radius + 1, 2 * radius + 1), borderType=cv2.BORDER_REFLECT)
+
+
+def guided_upsample(alpha, guide, radius=8, eps=1e-4):
+    """Upsample a low resolution alpha matte to the guide's size
+
+    Fast guided filter (He & Sun, 2015): the local linear coefficients are
+    solved at the alpha's resolution against a downscaled guide, then
+    bilinearly upsampled and applied to the full resolution guide. Edges
+    follow the original pixels while the solve costs only the low
+    resolution size.
+    """
+    guide_gray = np.asarray(guide.convert('L'), dtype=np.float32)
+    guide_gray /= 255.0
+    full_h, full_w = guide_gray.shape
+
+    p = np.asarray(alpha.convert('L'), dtype=np.float32) / 255.0
+    low_h, low_w = p.shape
+    guide_low = cv2.resize(guide_gray, (low_w, low_h), interpolation=cv2.INTER_AREA)
+
+    mean_i = _box(guide_low, radius)
+    mean_p = _box(p, radius)
+    cov_ip = _box(guide_low * p, radius) - mean_i * mean_p
+    var_i = _box(guide_low * guide_low, radius) - mean_i * mean_i
+
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    mean_a = _box(a, radius)
+    mean_b = _box(b, radius)
+
+    # q = A * I + B at full resolution, computed in place to limit copies
+    q = cv2.resize(mean_a, (full_w, full_h), interpolation=cv2.INTER_LINEAR)
+    q *= guide_gray
+    del guide_gray
+    q += cv2.resize(mean_b, (full_w, full_h), interpolation=cv2.INTER_LINEAR)
+    q *= 255.0
+    np.clip(q, 0, 255, out=q)
+    return Image.fromarray(q.astype(np.uint8))
+
+
+def bilinear_sample(array, xs, ys, size):
+    """Values of a low resolution (h, w, ...) array at full resolution pixels
+
+    `xs`/`ys` are pixel coordinates in an image of `size`; only these
+    points are interpolated, so no full resolution copy is made.
+    """
+    low_h, low_w = array.shape[:2]
+    full_w, full_h = size
+    # Pixel centers, as cv2.resize with INTER_LINEAR maps them
+    fx = np.clip((xs + 0.5) * (low_w / full_w) - 0.5, 0, low_w - 1)
+    fy = np.clip((ys + 0.5) * (low_h / full_h) - 0.5, 0, low_h - 1)
+    x0 = fx.astype(np.intp)
+    y0 = fy.astype(np.intp)
+    x1 = np.minimum(x0 + 1, low_w - 1)
+    y1 = np.minimum(y0 + 1, low_h - 1)
+    wx = (fx - x0).astype(np.float32)
+    wy = (fy - y0).astype(np.float32)
+    if array.ndim == 3:
+        wx, wy = wx[:, np.newaxis], wy[:, np.newaxis]
+    top = array[y0, x0] * (1 - wx) + array[y0, x1] * wx
+    bottom = array[y1, x0] * (1 - wx) + array[y1, x1] * wx
+    return top * (1 - wy) + bottom * wy
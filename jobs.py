@@ -0,0 +1,141 @@
+import os
+import time
+import uuid
+import threading
+
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised from progress updates of a cancelled job to stop its run"""
+
+
+class Job:
+    """State of one asynchronous processing job"""
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "queued"
+        self.stage = "Queued"
+        self.progress = 0
+        # The result itself lives in the app's byte-bounded result store
+        self.result_id = None
+        # Encoding profile of the PNG served for the job
+        self.result_profile = None
+        # Per-stage costs reported by the pipeline
+        self.timings = None
+        # Low resolution cutout, available before the full result
+        self.preview = None
+        self.error = None
+        # Pool futures running for this job, cancelled with it
+        self.futures = []
+        self.created_at = time.time()
+        self.finished_at = None
+        # Bumped on every change so event streams know when to send an update
+        self.version = 0
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "preview": self.preview is not None,
+            "result_id": self.result_id,
+            "timings": self.timings,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    """In-memory job registry; finished jobs expire after `ttl` seconds"""
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(ttl=int(os.getenv("JOB_TTL_SECONDS", "600")))
+
+    def create(self):
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge_expired()
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def update(self, job, progress, stage):
+        """Progress callback target; safe to call from worker threads
+
+        Raises JobCancelled once the job is cancelled, which stops a thread
+        worker at the next stage instead of finishing a result nobody reads.
+        """
+        with self._lock:
+            if job.status == "cancelled":
+                raise JobCancelled(job.id)
+            job.status = "running"
+            job.progress = progress
+            job.stage = stage
+            job.version += 1
+
+    def set_preview(self, job, preview):
+        with self._lock:
+            if job.status == "cancelled":
+                return
+            job.preview = preview
+            job.version += 1
+
+    def finish(self, job, error=None, result_id=None, result_profile=None, timings=None):
+        with self._lock:
+            if job.status == "cancelled":
+                return
+            if error is None:
+                job.status = "done"
+                job.stage = "Complete"
+                job.progress = 100
+                job.result_id = result_id
+                job.result_profile = result_profile
+                job.timings = timings
+            else:
+                job.status = "failed"
+                job.stage = "Failed"
+                job.error = error
+            job.finished_at = time.time()
+            job.version += 1
+
+    def cancel(self, job):
+        """Stop an unfinished job; queued work is dropped from the pool
+
+        Returns False when the job had already finished.
+        """
+        with self._lock:
+            if job.status in FINISHED_STATUSES:
+                return False
+            job.status = "cancelled"
+            job.stage = "Cancelled"
+            job.finished_at = time.time()
+            job.version += 1
+            futures = list(job.futures)
+        for future in futures:
+            future.cancel()
+        return True
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -1,14 +1,8 @@
-import os
-import time
-import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageDraw
+from PIL import Image
 import streamlit as st
-from rembg import remove, new_session
-import cv2
-from io import BytesIO
-import tempfile
+from pipeline import Pipeline
+import encoders
 from streamlit_image_comparison import image_comparison
-import base64
 
 # Configure for ultra-high-quality processing
 Image.MAX_IMAGE_PIXELS = None  # Remove image size limit
@@ -82,12 +76,14 @@ if 'processed_image' not in st.session_state:
     st.session_state.processed_image = None
 if 'bg_image' not in st.session_state:
     st.session_state.bg_image = None
+if 'bg_image_bytes' not in st.session_state:
+    st.session_state.bg_image_bytes = None
 if 'processing_done' not in st.session_state:
     st.session_state.processing_done = False
-if 'session' not in st.session_state:
-    st.session_state.session = new_session("u2net_human_seg")
 if 'processing_progress' not in st.session_state:
     st.session_state.processing_progress = 0
+if 'stage_timings' not in st.session_state:
+    st.session_state.stage_timings = []
 
 # --- 🎚️ SIDEBAR CONTROLS ---
 with st.sidebar:
@@ -137,6 +133,7 @@ with st.sidebar:
             bg_upload = st.file_uploader("Upload Background", type=["jpg", "jpeg", "png"])
             if bg_upload:
                 st.session_state.bg_image = Image.open(bg_upload)
+                st.session_state.bg_image_bytes = bg_upload.getvalue()
                 st.image(st.session_state.bg_image, caption="Background Preview", use_column_width=True)
         elif bg_choice == "Gradient":
             col1, col2 = st.columns(2)
@@ -144,6 +141,8 @@ with st.sidebar:
                 gradient_start = st.color_picker("Start Color", "#4CAF50")
             with col2:
                 gradient_end = st.color_picker("End Color", "#2196F3")
+            gradient_mode = st.selectbox("Gradient Style", ["linear", "radial", "angled"], index=0)
+            gradient_angle = st.slider("Gradient Angle", 0, 359, 45) if gradient_mode == "angled" else 0
         else:
             bg_color = {
                 "Transparent": None,
@@ -228,11 +227,15 @@ if uploaded_file:
                 width=700
             )
 
+            if st.session_state.stage_timings:
+                with st.expander("⏱️ Stage Timings"):
+                    st.table(st.session_state.stage_timings)
+
             # Download Options with improved UI
             st.markdown("**💾 Download Options**")
             col1, col2 = st.columns(2)
             with col1:
-                export_format = st.radio("Format", ["PNG (Lossless)", "JPG (High Quality)", "TIFF (Maximum Quality)"], index=0)
+                export_format = st.radio("Format", ["PNG (Lossless)", "WebP (Small, Transparent)", "JPG (High Quality)", "TIFF (Maximum Quality)"], index=0)
             with col2:
                 if st.button("⬇️ Download", use_container_width=True):
                     download_processed_image(export_format)
@@ -241,75 +244,71 @@ if uploaded_file:
         st.markdown('</div>', unsafe_allow_html=True)
 
 # --- 🛠️ ULTRA HD PROCESSING FUNCTIONS ---
+@st.cache_resource(show_spinner=False)
+def get_pipeline():
+    """Models and stage caches shared across all user sessions"""
+    return Pipeline.from_env(default_model="u2net")
+
+def current_pipeline_settings(model_name):
+    """Sidebar values in the shared pipeline's settings schema"""
+    settings = {
+        'model': model_name,
+        'quality': processing_quality,
+        'edge_refinement': edge_refinement,
+        'edge_passes': 3,
+        'preserve_details': preserve_details,
+        'upscale_small': upscale_small,
+        'enhance_details': enhance_details,
+        'super_resolution': super_resolution,
+        'matting_foreground': matting_foreground,
+        'matting_background': matting_background,
+        'matting_erode': matting_erode,
+        'feather_edges': feather_edges,
+        'feather_amount': feather_amount,
+        'contrast_boost': contrast_boost,
+        'sharpness_boost': sharpness_boost,
+    }
+
+    if bg_choice == "Upload Image":
+        if st.session_state.bg_image_bytes:
+            settings['background_type'] = "Image"
+            settings['bg_image_bytes'] = st.session_state.bg_image_bytes
+    elif bg_choice == "Gradient":
+        settings.update({
+            'background_type': "Gradient",
+            'gradient_start': gradient_start,
+            'gradient_end': gradient_end,
+            'gradient_mode': gradient_mode,
+            'gradient_angle': gradient_angle,
+        })
+    elif bg_color:
+        settings['background_type'] = "Color"
+        settings['bg_color'] = bg_color
+    return settings
+
 def process_ultra_hd(image, model_name="u2net"):
     """Process image with ultra HD quality settings"""
     progress_bar = st.progress(0)
     status_text = st.empty()
     
+    def report(percent, text):
+        progress_bar.progress(percent)
+        status_text.text(text)
+    
     try:
-        # Convert to RGB if needed
-        img = image.convert('RGB') if image.mode != 'RGB' else image
-        
-        # Update progress
-        progress_bar.progress(10)
-        status_text.text("🔍 Analyzing image...")
-        
-        if processing_quality == "Ultra HD":
-            # Stage 1: Initial background removal
-            progress_bar.progress(20)
-            status_text.text("🎯 Removing background...")
-            result = remove(
-                img,
-                session=new_session(model_name),
-                alpha_matting=True,
-                alpha_matting_foreground_threshold=matting_foreground,
-                alpha_matting_background_threshold=matting_background,
-                alpha_matting_erode_size=matting_erode,
-                post_process_mask=preserve_details
-            )
-            
-            # Stage 2: Create high-precision mask
-            progress_bar.progress(40)
-            status_text.text("📐 Creating precision mask...")
-            mask = remove(img, session=new_session(model_name), only_mask=True)
-            
-            # Stage 3: Edge refinement
-            if edge_refinement:
-                progress_bar.progress(60)
-                status_text.text("✨ Refining edges...")
-                result = ultra_hd_edge_refinement(result, mask)
-            
-            # Stage 4: Detail enhancement
-            if enhance_details:
-                progress_bar.progress(80)
-                status_text.text("🎨 Enhancing details...")
-                result = ultra_hd_detail_enhancement(result)
-            
-            # Stage 5: Super Resolution
-            if super_resolution and max(img.size) < 4000:
-                progress_bar.progress(90)
-                status_text.text("🚀 Applying super resolution...")
-                result = apply_super_resolution(result)
-            
-            # Stage 6: Upscale if needed
-            if upscale_small and max(img.size) < 2000:
-                result = result.resize((img.size[0]*2, img.size[1]*2), Image.LANCZOS)
-        else:
-            # Standard quality processing
-            result = remove(img, session=new_session(model_name))
-
-        # Final quality adjustments
-        progress_bar.progress(95)
-        status_text.text("✨ Applying final touches...")
-        result = apply_ultra_hd_finishing(result)
+        report(10, "🔍 Analyzing image...")
+        result = get_pipeline().run(
+            image,
+            current_pipeline_settings(model_name),
+            lambda percent, stage: report(percent, f"{stage}...")
+        )
+        st.session_state.stage_timings = result.timings_dict()
         
-        progress_bar.progress(100)
-        status_text.text("✅ Processing complete!")
-        time.sleep(1)  # Show completion briefly
+        report(100, "✅ Processing complete!")
         progress_bar.empty()
         status_text.empty()
         
-        return result
+        return result.image
         
     except Exception as e:
         progress_bar.empty()
@@ -317,176 +316,22 @@ def process_ultra_hd(image, model_name="u2net"):
         st.error(f"Error during processing: {str(e)}")
         return None
 
-def ultra_hd_edge_refinement(image, mask):
-    """AI-enhanced ultra HD edge refinement with proper type handling"""
-    img_array = np.array(image)
-    mask_array = np.array(mask)
-    
-    if len(mask_array.shape) == 3:
-        mask_array = cv2.cvtColor(mask_array, cv2.COLOR_RGB2GRAY)
-    
-    # Convert to float32 for high precision operations
-    mask_array = mask_array.astype(np.float32) / 255.0
-    
-    # Ultra HD multi-stage refinement
-    for i in range(3 if processing_quality == "Ultra HD" else 1):
-        # Bilateral filtering for edge-aware smoothing
-        mask_array = cv2.bilateralFilter(mask_array, 9, 75, 75)
-        
-        # Morphological operations for clean edges
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3,3))
-        mask_array = cv2.morphologyEx(mask_array, cv2.MORPH_CLOSE, kernel)
-        mask_array = cv2.morphologyEx(mask_array, cv2.MORPH_OPEN, kernel)
-        
-        # Edge sharpening with proper type conversion
-        if i == 1:
-            laplacian = cv2.Laplacian(mask_array, cv2.CV_32F)
-            # Ensure both arrays have same type before operation
-            mask_array = cv2.addWeighted(
-                mask_array.astype(np.float32), 1.5, 
-                laplacian.astype(np.float32), -0.5, 
-                0, dtype=cv2.CV_32F
-            )
-    
-    # Advanced edge feathering
-    if feather_edges:
-        mask_array = cv2.GaussianBlur(mask_array, (feather_amount*2+1, feather_amount*2+1), 0)
-        mask_array = cv2.normalize(mask_array, None, 0, 1, cv2.NORM_MINMAX, dtype=cv2.CV_32F)
-    
-    # Convert back to 8-bit
-    mask_array = (mask_array * 255).clip(0, 255).astype(np.uint8)
-    
-    # Handle RGBA vs RGB images
-    if image.mode == 'RGBA':
-        rgb = img_array[:, :, :3]
-        alpha = mask_array
-        result = np.dstack((rgb, alpha))
-    else:
-        result = np.dstack((img_array, mask_array))
-    
-    return Image.fromarray(result)
-
-def ultra_hd_detail_enhancement(image):
-    """Ultra HD detail enhancement with proper type handling"""
-    img_array = np.array(image)
-    
-    # Convert to LAB color space for better detail preservation
-    if image.mode == 'RGBA':
-        rgb = img_array[:, :, :3]
-        alpha = img_array[:, :, 3]
-        lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)
-    else:
-        lab = cv2.cvtColor(img_array, cv2.COLOR_RGB2LAB)
-    
-    # Split channels and ensure proper types
-    l, a, b = cv2.split(lab)
-    l = l.astype(np.float32)
-    
-    # Apply CLAHE to L channel for local contrast enhancement
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-    l = clahe.apply(l.astype(np.uint8)).astype(np.float32)
-    
-    # Merge channels and convert back
-    lab = cv2.merge((l.astype(np.uint8), a, b))
-    rgb = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
-    
-    # Convert back to RGBA if needed
-    if image.mode == 'RGBA':
-        result = np.dstack((rgb, alpha))
-    else:
-        result = rgb
-    
-    # Apply sharpening if enabled
-    if sharpness_boost > 0:
-        enhanced_img = Image.fromarray(result)
-        enhancer = ImageEnhance.Sharpness(enhanced_img)
-        result = np.array(enhancer.enhance(1.0 + sharpness_boost))
-    
-    return Image.fromarray(result)
-
-def apply_super_resolution(image):
-    """Apply super resolution to enhance details"""
-    # Note: In production, you would integrate with a real SR model like ESRGAN
-    # This is a placeholder implementation using high-quality upscaling
-    if processing_quality == "Ultra HD":
-        return image.resize((image.size[0]*2, image.size[1]*2), Image.LANCZOS)
-    return image
-
-def apply_ultra_hd_finishing(image):
-    """Apply final ultra HD quality adjustments"""
-    # Contrast boost
-    if contrast_boost != 1.0:
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(contrast_boost)
-    
-    # Sharpness boost
-    if sharpness_boost > 0:
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(1.0 + sharpness_boost)
-    
-    return image
-
-def apply_custom_background(foreground, bg_image=None, bg_color=None):
-    """Apply custom background with ultra HD blending"""
-    if bg_color:
-        bg = Image.new("RGB", foreground.size, bg_color)
-        if foreground.mode == 'RGBA':
-            alpha = foreground.split()[3]
-            # Ultra HD blending with improved alpha compositing
-            bg.paste(foreground, mask=alpha)
-        else:
-            bg.paste(foreground)
-        return bg
-    elif bg_image:
-        bg = bg_image.resize(foreground.size, Image.LANCZOS)
-        if foreground.mode == 'RGBA':
-            alpha = foreground.split()[3]
-            bg.paste(foreground, mask=alpha)
-        else:
-            bg.paste(foreground)
-        return bg
-    return foreground  # Transparent
-
-def apply_gradient_background(image, start_color, end_color):
-    """Apply a gradient background to the image"""
-    width, height = image.size
-    gradient_image = Image.new('RGB', (width, height), start_color)
-    gradient_image.putpixel((0, 0), start_color)
-    gradient_image.putpixel((width-1, 0), end_color)
-    gradient_image.putpixel((0, height-1), start_color)
-    gradient_image.putpixel((width-1, height-1), end_color)
-    
-    # Create a mask based on the image's alpha channel
-    mask = Image.new('L', image.size, 0)
-    mask.putdata(image.convert('L').getdata())
-    
-    # Apply the gradient to the image
-    result = Image.composite(gradient_image, image, mask)
-    
-    return result
-
 def download_processed_image(format_type):
     """Generate ultra HD download link with maximum quality options"""
-    buffered = BytesIO()
-    
     if format_type == "PNG (Lossless)":
-        st.session_state.processed_image.save(buffered, format="PNG", compress_level=0)
-        mime_type = "image/png"
-        file_ext = "png"
+        result = encoders.encode(st.session_state.processed_image, "PNG")
+    elif format_type == "WebP (Small, Transparent)":
+        result = encoders.encode(st.session_state.processed_image, "WEBP", lossless=True)
     elif format_type == "JPG (High Quality)":
-        st.session_state.processed_image.convert("RGB").save(buffered, format="JPEG", quality=100, subsampling=0)
-        mime_type = "image/jpeg"
-        file_ext = "jpg"
+        result = encoders.encode(st.session_state.processed_image, "JPG")
     else:  # TIFF
-        st.session_state.processed_image.save(buffered, format="TIFF", compression="tiff_deflate")
-        mime_type = "image/tiff"
-        file_ext = "tif"
+        result = encoders.encode(st.session_state.processed_image, "TIFF")
     
     st.download_button(
         label="⬇️ Download Ultra HD Image",
-        data=buffered.getvalue(),
-        file_name=f"ultra_hd_processed.{file_ext}",
-        mime=mime_type
+        data=result.data,
+        file_name=f"ultra_hd_processed.{result.extension}",
+        mime=result.mime_type
     )
 
 # --- 🎛️ PROCESS BUTTON ---
@@ -495,29 +340,13 @@ if uploaded_file:
     if st.button("✨ Process Image", type="primary", use_container_width=True):
         with st.spinner("Processing image..."):
             try:
+                # The background is the last pipeline stage, so changing
+                # only the background reuses every earlier stage
                 st.session_state.processed_image = process_ultra_hd(
                     st.session_state.original_image,
                     model_options[selected_model]
                 )
                 
-                # Apply background
-                if bg_choice == "Upload Image" and st.session_state.bg_image:
-                    st.session_state.processed_image = apply_custom_background(
-                        st.session_state.processed_image,
-                        st.session_state.bg_image
-                    )
-                elif bg_choice == "Gradient":
-                    st.session_state.processed_image = apply_gradient_background(
-                        st.session_state.processed_image,
-                        gradient_start,
-                        gradient_end
-                    )
-                elif bg_choice != "Transparent":
-                    st.session_state.processed_image = apply_custom_background(
-                        st.session_state.processed_image,
-                        bg_color=bg_color
-                    )
-                
                 st.session_state.processing_done = True
                 st.rerun()
             except Exception as e:
@@ -0,0 +1,152 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+
+def image_fingerprint(img):
+    """Content hash of the decoded pixels, independent of the upload encoding"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img.mode}:{img.size[0]}x{img.size[1]}".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+class MaskCache:
+    """LRU cache of raw model masks keyed by (image hash, model name)
+
+    Masks are kept as uint8 arrays in memory up to `max_bytes`. When
+    `disk_dir` is set, every mask is also written there as a PNG so the cache
+    survives restarts and is shared between worker processes. The directory
+    is kept under `max_disk_bytes` by deleting the least recently used files
+    (by modification time, which disk hits refresh).
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None, max_disk_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_size = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_size = sum(size for _, _, size in self._disk_files())
+
+    @classmethod
+    def from_env(cls):
+        """Build a cache from MASK_CACHE_* environment variables"""
+        return cls(
+            max_bytes=int(os.getenv("MASK_CACHE_MB", "256")) * 1024 * 1024,
+            disk_dir=os.getenv("MASK_CACHE_DIR") or None,
+            max_disk_bytes=int(os.getenv("MASK_CACHE_DISK_MB", "1024")) * 1024 * 1024,
+        )
+
+    @staticmethod
+    def make_key(fingerprint, model_name):
+        return f"{model_name}-{fingerprint}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def get(self, key):
+        """Return the cached mask as a PIL image, or None"""
+        with self._lock:
+            array = self._entries.get(key)
+            if array is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return Image.fromarray(array)
+
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with Image.open(self._disk_path(key)) as mask:
+                    array = np.array(mask.convert('L'))
+                # Marks the file as recently used for disk eviction
+                os.utime(self._disk_path(key))
+            except Exception:
+                array = None
+            if array is not None:
+                self._store(key, array)
+                with self._lock:
+                    self.hits += 1
+                return Image.fromarray(array)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, mask):
+        """Cache a mask given as a PIL image"""
+        array = np.array(mask.convert('L'))
+        self._store(key, array)
+        if self.disk_dir:
+            tmp_path = self._disk_path(key) + ".tmp"
+            try:
+                Image.fromarray(array).save(tmp_path, format="PNG", compress_level=1)
+                size = os.path.getsize(tmp_path)
+                # An overwritten file no longer counts towards the budget
+                try:
+                    size -= os.path.getsize(self._disk_path(key))
+                except OSError:
+                    pass
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError:
+                return
+            with self._lock:
+                self._disk_size += size
+                over_budget = self._disk_size > self.max_disk_bytes
+            if over_budget:
+                self._evict_disk()
+
+    def _disk_files(self):
+        """(mtime, path, size) of every cached mask file"""
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".png"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        return files
+
+    def _evict_disk(self):
+        # Other processes share the directory, so the real sizes are rescanned
+        files = sorted(self._disk_files())
+        size = sum(file_size for _, _, file_size in files)
+        # Evicting down to 90% avoids a rescan on every following put
+        target = self.max_disk_bytes * 0.9
+        for _, path, file_size in files:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= file_size
+        with self._lock:
+            self._disk_size = size
+
+    def _store(self, key, array):
+        if array.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous.nbytes
+            self._entries[key] = array
+            self._size += array.nbytes
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
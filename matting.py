@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from PIL import Image
+from pymatting.alpha.estimate_alpha_cf import estimate_alpha_cf
+from pymatting.foreground.estimate_foreground_ml import estimate_foreground_ml
+from runtime_config import MATTING_THREADS
+
+# Largest tile solved in one go, and the known-pixel context added around it
+MAX_TILE_SIZE = 256
+TILE_PADDING = 16
+
+
+def build_trimap(mask, foreground_threshold, background_threshold, erode_size):
+    """Trimap with 255 for definite foreground, 0 for background, 128 unknown
+
+    Matches rembg's alpha_matting_cutout: thresholds followed by a square
+    erosion of both definite regions.
+    """
+    mask_array = np.asarray(mask.convert('L'))
+    is_foreground = (mask_array > foreground_threshold).astype(np.uint8)
+    is_background = (mask_array < background_threshold).astype(np.uint8)
+
+    if erode_size > 0:
+        kernel = np.ones((erode_size, erode_size), np.uint8)
+        is_foreground = cv2.erode(is_foreground, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+        is_background = cv2.erode(is_background, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=1)
+
+    trimap = np.full(mask_array.shape, 128, dtype=np.uint8)
+    trimap[is_foreground.astype(bool)] = 255
+    trimap[is_background.astype(bool)] = 0
+    return trimap
+
+
+def unknown_tiles(unknown):
+    """Split the unknown band into tiles of at most MAX_TILE_SIZE per side
+
+    Each connected piece of the band gets its own bounding box; large boxes
+    are cut into a grid and cells without unknown pixels are dropped.
+    """
+    count, _, stats, _ = cv2.connectedComponentsWithStats(unknown.astype(np.uint8), connectivity=8)
+    tiles = []
+    for label in range(1, count):
+        x, y, w, h = stats[label, :4]
+        for ty in range(y, y + h, MAX_TILE_SIZE):
+            for tx in range(x, x + w, MAX_TILE_SIZE):
+                x1 = min(tx + MAX_TILE_SIZE, x + w)
+                y1 = min(ty + MAX_TILE_SIZE, y + h)
+                if unknown[ty:y1, tx:x1].any():
+                    tiles.append((tx, ty, x1, y1))
+    return tiles
+
+
+def _solve_tile(image, trimap, mask_array, tile):
+    """Alpha and foreground for one tile; returns the unpadded core"""
+    x0, y0, x1, y1 = tile
+    height, width = trimap.shape
+    px0, py0 = max(x0 - TILE_PADDING, 0), max(y0 - TILE_PADDING, 0)
+    px1, py1 = min(x1 + TILE_PADDING, width), min(y1 + TILE_PADDING, height)
+
+    image_crop = image[py0:py1, px0:px1]
+    trimap_crop = trimap[py0:py1, px0:px1] / 255.0
+    try:
+        alpha = estimate_alpha_cf(image_crop, trimap_crop)
+    except Exception:
+        # Tiles without any known pixels cannot be solved; keep the model mask
+        alpha = mask_array[py0:py1, px0:px1] / 255.0
+    alpha = np.clip(alpha, 0, 1)
+    foreground = estimate_foreground_ml(image_crop, alpha)
+
+    core = (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0))
+    return tile, alpha[core], foreground[core]
+
+
+def band_matting_cutout(img, mask, foreground_threshold, background_threshold, erode_size):
+    """Alpha matted cutout that only solves the trimap's unknown band
+
+    A drop-in replacement for rembg's alpha_matting_cutout. Definite pixels
+    are copied from the trimap and image; only tiles covering the unknown
+    band go through closed-form matting and foreground estimation.
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    image_array = np.asarray(img)
+    trimap = build_trimap(mask, foreground_threshold, background_threshold, erode_size)
+    unknown = trimap == 128
+
+    rgb = image_array.copy()
+    alpha = trimap.copy()
+    alpha[unknown] = 0
+
+    tiles = unknown_tiles(unknown)
+    if tiles:
+        image_normalized = image_array / 255.0
+        mask_array = np.asarray(mask.convert('L'))
+
+        def solve(tile):
+            return _solve_tile(image_normalized, trimap, mask_array, tile)
+
+        if MATTING_THREADS > 1 and len(tiles) > 1:
+            with ThreadPoolExecutor(max_workers=MATTING_THREADS) as executor:
+                solved = list(executor.map(solve, tiles))
+        else:
+            solved = [solve(tile) for tile in tiles]
+
+        # Write back only the unknown pixels of each tile
+        for (x0, y0, x1, y1), tile_alpha, tile_foreground in solved:
+            band = unknown[y0:y1, x0:x1]
+            alpha[y0:y1, x0:x1][band] = (tile_alpha[band] * 255).round().astype(np.uint8)
+            rgb[y0:y1, x0:x1][band] = (np.clip(tile_foreground[band], 0, 1) * 255).round().astype(np.uint8)
+
+    return Image.fromarray(np.dstack((rgb, alpha)))
@@ -0,0 +1,18 @@
+# Background removal pipeline shared by app.py, main.py and test.py
+from .graph import Stage, StageGraph, StageCache, StageTiming
+from .settings import SETTINGS_SCHEMA, normalize_settings, coerce_setting, validate_settings
+
+# The engine and stages pull in rembg, OpenCV and pymatting; they are
+# imported on first access so `import pipeline` stays cheap
+_LAZY = {
+    'Pipeline': 'engine',
+    'PipelineResult': 'engine',
+    'prepare_image': 'stages',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    return getattr(import_module(f".{_LAZY[name]}", __name__), name)
@@ -0,0 +1,180 @@
+import os
+import tracemalloc
+from PIL import Image
+from rembg.bg import naive_cutout
+from session_registry import SessionRegistry
+from runtime_config import RuntimeConfig
+from mask_cache import MaskCache, image_fingerprint
+from compositing import BackgroundAssetCache
+from guided_filter import working_size
+from .graph import Stage, StageGraph, StageCache, measure
+from .settings import normalize_settings
+from . import stages
+
+MATTING_SETTINGS = ('preserve_details', 'matting_foreground', 'matting_background', 'matting_erode')
+EDGE_SETTINGS = ('edge_refinement', 'edge_passes', 'feather_edges', 'feather_amount')
+FINISHING_SETTINGS = ('contrast_boost', 'sharpness_boost', 'effect')
+BACKGROUND_SETTINGS = (
+    'background_type', 'bg_color', 'gradient_start', 'gradient_end',
+    'gradient_mode', 'gradient_angle', 'bg_image_id', 'bg_image_bytes'
+)
+
+
+class PipelineResult:
+    """Processed image plus the per-stage costs of producing it"""
+
+    def __init__(self, image, timings):
+        self.image = image
+        self.timings = timings
+
+    @property
+    def total_ms(self):
+        return sum(timing.wall_ms for timing in self.timings)
+
+    def timings_dict(self):
+        return [timing.to_dict() for timing in self.timings]
+
+
+class Pipeline:
+    """Background removal engine shared by the web API, Streamlit and Tk apps
+
+    Quality "Ultra HD" runs segmentation, alpha matting, edge refinement,
+    alpha upsampling, detail enhancement and scaling; any other quality is
+    a plain cutout. Both finish with adjustments and the background. Stage
+    outputs are cached, so changing a late setting only reruns the stages
+    after it.
+    """
+
+    def __init__(self, sessions, masks=None, stage_cache=None, background_assets=None,
+                 working_max_pixels=24 * 1000 * 1000, trace_memory=False):
+        self.sessions = sessions
+        self.masks = masks
+        self.stage_cache = stage_cache
+        self.background_assets = background_assets or BackgroundAssetCache()
+        self.working_max_pixels = working_max_pixels
+        # Peak stage memory comes from tracemalloc, which slows Python-heavy
+        # stages such as matting noticeably; off unless asked for
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        self.ultra_hd_graph = StageGraph([
+            Stage('work', self._working_image, ['source'], ['high_resolution'], cached=False),
+            # Raw masks have their own cache
+            Stage('mask', self._mask, ['work'], ['model'], cached=False, progress=(20, "Removing background")),
+            Stage('work_mask', self._conform_mask, ['mask', 'work'], cached=False),
+            Stage('cutout', stages.matted_cutout, ['work', 'work_mask'], MATTING_SETTINGS, progress=(40, "Creating precision mask")),
+            Stage('refined', self._refine, ['cutout', 'work_mask'], EDGE_SETTINGS, progress=(60, "Refining edges")),
+            Stage('upsampled', self._upsample, ['refined', 'source'], progress=(70, "Upsampling alpha")),
+            Stage('enhanced', self._enhance, ['upsampled'], ['enhance_details'], progress=(80, "Enhancing details")),
+            Stage('scaled', self._scale, ['enhanced', 'source'], ['super_resolution', 'upscale_small']),
+            Stage('finished', stages.apply_finishing, ['scaled'], FINISHING_SETTINGS),
+            Stage('result', self._background, ['finished'], BACKGROUND_SETTINGS, cached=False, progress=(95, "Applying final touches")),
+        ], stage_cache)
+
+        self.standard_graph = StageGraph([
+            Stage('mask', self._mask, ['source'], ['model'], cached=False, progress=(20, "Removing background")),
+            Stage('cutout', lambda img, mask, settings: naive_cutout(img, mask), ['source', 'mask']),
+            Stage('finished', stages.apply_finishing, ['cutout'], FINISHING_SETTINGS),
+            Stage('result', self._background, ['finished'], BACKGROUND_SETTINGS, cached=False, progress=(95, "Applying final touches")),
+        ], stage_cache)
+
+    @classmethod
+    def from_env(cls, default_model=None):
+        """Pipeline with caches and threads configured from the same variables as the API"""
+        runtime = RuntimeConfig.from_env()
+        runtime.apply_opencv()
+        sessions = SessionRegistry.from_env(runtime)
+        if default_model:
+            sessions.default_model = sessions.resolve(default_model)
+        return cls(
+            sessions,
+            MaskCache.from_env(),
+            StageCache.from_env(),
+            BackgroundAssetCache.from_env(),
+            int(os.getenv("WORKING_MAX_PIXELS", str(24 * 1000 * 1000))),
+            os.getenv("PIPELINE_TRACE_MEMORY", "0") == "1",
+        )
+
+    def predict_mask(self, img, model_name=None):
+        """Run the segmentation model once and return its raw mask"""
+        model_name = self.sessions.resolve(model_name)
+        if self.masks is None:
+            return self.sessions.get(model_name).predict(img)[0]
+        key = MaskCache.make_key(image_fingerprint(img), model_name)
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = self.sessions.get(model_name).predict(img)[0]
+            self.masks.put(key, mask)
+        return mask
+
+    def run(self, image, settings, progress=None, mask=None):
+        """Process image and return a PipelineResult
+
+        `progress(percent, stage)` is called as each stage starts running.
+        `mask` is an already predicted raw mask for the prepared image.
+        """
+        settings = normalize_settings(settings)
+        # Resolved up front so the quality tier's model is part of stage keys
+        settings['model'] = self.sessions.resolve(settings['model'], settings['quality'])
+        timings = []
+
+        def prepare():
+            img = stages.prepare_image(image)
+            return img, image_fingerprint(img)
+
+        (img, fingerprint), timing = measure('prepare', prepare)
+        timings.append(timing)
+
+        graph = self.ultra_hd_graph if settings['quality'] == "Ultra HD" else self.standard_graph
+        result = graph.run(
+            {'source': (img, fingerprint)},
+            settings,
+            progress,
+            given={'mask': mask} if mask is not None else None,
+            timings=timings
+        )
+        return PipelineResult(result, timings)
+
+    def _working_image(self, img, settings):
+        # Very large images are segmented and matted at a bounded size
+        if settings['high_resolution']:
+            size = working_size(img.size, self.working_max_pixels)
+            if size != img.size:
+                return img.resize(size, Image.LANCZOS)
+        return img
+
+    def _mask(self, img, settings):
+        return self.predict_mask(img, settings['model'])
+
+    def _conform_mask(self, mask, work, settings):
+        # A mask predicted for the full image is brought to the working size
+        if mask.size != work.size:
+            return mask.resize(work.size, Image.LANCZOS)
+        return mask
+
+    def _refine(self, cutout, mask, settings):
+        if not settings['edge_refinement']:
+            return cutout
+        feather = settings['feather_amount'] if settings['feather_edges'] else 0
+        return stages.edge_refinement(cutout, mask, settings['edge_passes'], feather)
+
+    def _upsample(self, cutout, img, settings):
+        if cutout.size == img.size:
+            return cutout
+        return stages.upsample_alpha(cutout, img)
+
+    def _enhance(self, image, settings):
+        if settings['enhance_details']:
+            return stages.detail_enhancement(image)
+        return image
+
+    def _scale(self, image, img, settings):
+        # Thresholds refer to the size of the original image
+        if settings['super_resolution'] and max(img.size) < 4000:
+            image = stages.apply_super_resolution(image)
+        if settings['upscale_small'] and max(img.size) < 2000:
+            image = image.resize((img.size[0]*2, img.size[1]*2), Image.LANCZOS)
+        return image
+
+    def _background(self, image, settings):
+        return stages.apply_background(image, settings, self.background_assets)
@@ -0,0 +1,211 @@
+import os
+import time
+import hashlib
+import threading
+import tracemalloc
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+
+class Stage:
+    """One node of a processing graph
+
+    `func(*inputs, settings)` receives the outputs of the stages (or graph
+    sources) named in `inputs` and only the settings listed in `settings`,
+    so a stage cannot read a value that is missing from its cache key.
+    Stage functions must not modify their inputs; cached outputs are
+    shared between runs.
+    """
+
+    def __init__(self, name, func, inputs=(), settings=(), cached=True, progress=None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.settings = tuple(settings)
+        self.cached = cached
+        # (percent, label) reported when the stage actually runs
+        self.progress = progress
+
+
+class StageTiming:
+    """Cost of one stage in one run
+
+    `cpu_ms` is CPU time of the calling thread and `output_bytes` the
+    size of the image or array the stage produced. `peak_bytes` is the
+    peak of traced allocations (NumPy and OpenCV arrays) above the level
+    at stage start; it is None unless tracemalloc is tracing, and with
+    concurrent runs it includes their allocations too.
+    """
+
+    def __init__(self, name, wall_ms=0.0, cpu_ms=0.0, output_bytes=0, peak_bytes=None, cached=False):
+        self.name = name
+        self.wall_ms = wall_ms
+        self.cpu_ms = cpu_ms
+        self.output_bytes = output_bytes
+        self.peak_bytes = peak_bytes
+        self.cached = cached
+
+    def to_dict(self):
+        return {
+            "stage": self.name,
+            "wall_ms": round(self.wall_ms, 2),
+            "cpu_ms": round(self.cpu_ms, 2),
+            "output_bytes": self.output_bytes,
+            "peak_bytes": self.peak_bytes,
+            "cached": self.cached,
+        }
+
+
+def measure(name, func, *args):
+    """Call func(*args) and return (value, StageTiming)"""
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    value = func(*args)
+    timing = StageTiming(
+        name,
+        (time.perf_counter() - wall) * 1000,
+        (time.thread_time() - cpu) * 1000,
+        _value_size(value),
+    )
+    if tracing:
+        timing.peak_bytes = max(tracemalloc.get_traced_memory()[1] - base, 0)
+    return value, timing
+
+
+def _value_size(value):
+    if isinstance(value, Image.Image):
+        return value.size[0] * value.size[1] * len(value.getbands())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 0
+
+
+class StageCache:
+    """LRU cache of stage outputs keyed by stage key, bounded by bytes"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_bytes=int(os.getenv("PIPELINE_CACHE_MB", "256")) * 1024 * 1024)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = _value_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+def _setting_part(key, value):
+    # Large binary settings (background uploads) are keyed by their hash
+    if isinstance(value, (bytes, bytearray)):
+        value = hashlib.blake2b(value, digest_size=16).hexdigest()
+    return f"{key}={value!r}"
+
+
+def stage_key(stage, input_keys, settings):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(stage.name.encode())
+    for input_key in input_keys:
+        digest.update(b"\0" + input_key.encode())
+    for key in sorted(settings):
+        digest.update(b"\0" + _setting_part(key, settings[key]).encode())
+    return digest.hexdigest()
+
+
+class StageGraph:
+    """A DAG of stages evaluated on demand from the last stage backwards
+
+    Every stage key is derived from its inputs' keys and the settings it
+    uses, so changing a late setting (a background color, say) only
+    invalidates the stages downstream of it. Stages whose output is found
+    in the cache never request their inputs, so upstream work is skipped
+    entirely.
+    """
+
+    def __init__(self, stages, cache=None):
+        self.stages = {}
+        for stage in stages:
+            self.stages[stage.name] = stage
+        self.output = stages[-1].name
+        self.cache = cache
+
+    def run(self, sources, settings, progress=None, given=None, timings=None):
+        """Evaluate the graph and return the last stage's output
+
+        `sources` maps source names to (value, fingerprint) pairs. `given`
+        maps stage names to values the caller already has, such as a mask
+        predicted in a batch; they are used as-is instead of running the
+        stage. A StageTiming per evaluated stage is appended to `timings`.
+        """
+        timings = timings if timings is not None else []
+        report = progress or (lambda percent, stage: None)
+        given = given or {}
+        values = {name: value for name, (value, _) in sources.items()}
+        keys = {name: fingerprint for name, (_, fingerprint) in sources.items()}
+        stage_settings = {}
+
+        for stage in self.stages.values():
+            used = {key: settings[key] for key in stage.settings if key in settings}
+            stage_settings[stage.name] = used
+            keys[stage.name] = stage_key(stage, [keys[name] for name in stage.inputs], used)
+
+        def resolve(name):
+            if name in values:
+                return values[name]
+            if name in given:
+                values[name] = given[name]
+                return values[name]
+
+            stage = self.stages[name]
+            value = None
+            if stage.cached and self.cache is not None:
+                value = self.cache.get(keys[name])
+            if value is not None:
+                timings.append(StageTiming(name, output_bytes=_value_size(value), cached=True))
+            else:
+                inputs = [resolve(input_name) for input_name in stage.inputs]
+                if stage.progress:
+                    report(*stage.progress)
+                value, timing = measure(name, stage.func, *inputs, stage_settings[name])
+                timings.append(timing)
+                if stage.cached and self.cache is not None:
+                    self.cache.put(keys[name], value)
+            values[name] = value
+            return value
+
+        return resolve(self.output)
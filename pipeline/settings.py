@@ -0,0 +1,78 @@
+# Every setting the pipeline reads, with its type and default. Frontends
+# build settings from these names; unknown keys are ignored by the stages.
+SETTINGS_SCHEMA = {
+    # Segmentation
+    'model': (str, None),
+    'quality': (str, "Standard"),
+    'high_resolution': (bool, True),
+    # Matting
+    'preserve_details': (bool, True),
+    'matting_foreground': (int, 240),
+    'matting_background': (int, 10),
+    'matting_erode': (int, 15),
+    # Edges
+    'edge_refinement': (bool, True),
+    'edge_passes': (int, 1),
+    'feather_edges': (bool, False),
+    'feather_amount': (int, 0),
+    # Detail and size
+    'enhance_details': (bool, True),
+    'super_resolution': (bool, False),
+    'upscale_small': (bool, False),
+    # Finishing
+    'contrast_boost': (float, 1.0),
+    'sharpness_boost': (float, 0.0),
+    'effect': (str, "normal"),
+    # Background
+    'background_type': (str, "Transparent"),
+    'bg_color': (str, "#FFFFFF"),
+    'gradient_start': (str, "#4CAF50"),
+    'gradient_end': (str, "#2196F3"),
+    'gradient_mode': (str, "linear"),
+    'gradient_angle': (int, 0),
+    'bg_image_id': (str, None),
+    'bg_image_bytes': (bytes, None),
+}
+
+
+def normalize_settings(settings):
+    """Settings with every schema default filled in
+
+    Filling defaults keeps stage cache keys identical whether a value was
+    sent explicitly or left out.
+    """
+    normalized = {key: default for key, (_, default) in SETTINGS_SCHEMA.items()}
+    normalized.update({key: value for key, value in (settings or {}).items() if value is not None})
+    return normalized
+
+
+def validate_settings(settings):
+    """Raise ValueError for background settings the stages would reject"""
+    from PIL import ImageColor
+    from gradients import GRADIENT_MODES
+
+    settings = normalize_settings(settings)
+    if settings['background_type'] == "Gradient":
+        if settings['gradient_mode'] not in GRADIENT_MODES:
+            raise ValueError(
+                f"Unknown gradient mode: {settings['gradient_mode']}. "
+                f"Choose one of: {', '.join(GRADIENT_MODES)}"
+            )
+        colors = ('gradient_start', 'gradient_end')
+    else:
+        colors = ('bg_color',) if settings['background_type'] == "Color" else ()
+    for key in colors:
+        try:
+            ImageColor.getrgb(settings[key])
+        except ValueError:
+            raise ValueError(f"Invalid color for {key}: {settings[key]}")
+
+
+def coerce_setting(setting_type, value):
+    """Convert a string (form field, query parameter, CLI flag) to setting_type
+
+    Raises ValueError when the string is not a valid value.
+    """
+    if setting_type is bool:
+        return value.lower() in ('1', 'true', 'on', 'yes')
+    return setting_type(value)
@@ -0,0 +1,167 @@
+import numpy as np
+import cv2
+from PIL import Image, ImageEnhance, ImageFilter
+from rembg.bg import naive_cutout, post_process, fix_image_orientation
+from matting import band_matting_cutout
+from guided_filter import guided_upsample, bilinear_sample
+from gradients import apply_gradient_background
+from compositing import composite
+
+
+def prepare_image(image):
+    """Convert to RGB and apply EXIF orientation before segmentation"""
+    img = image.convert('RGB') if image.mode != 'RGB' else image
+    return fix_image_orientation(img)
+
+
+def matted_cutout(img, mask, settings):
+    """Build the alpha matted cutout from an already predicted mask"""
+    if settings['preserve_details']:
+        mask = Image.fromarray(post_process(np.array(mask)))
+    try:
+        return band_matting_cutout(
+            img,
+            mask,
+            settings['matting_foreground'],
+            settings['matting_background'],
+            settings['matting_erode']
+        )
+    except ValueError:
+        # Matting can fail on degenerate trimaps; fall back to a plain cutout
+        return naive_cutout(img, mask)
+
+
+def edge_refinement(image, mask, passes=1, feather=0):
+    """Refine edges of the processed image
+
+    Each pass smooths the mask edge-aware and cleans it morphologically;
+    the second pass also sharpens it. `feather` blurs the final edge.
+    """
+    img_array = np.asarray(image)
+    mask_array = np.asarray(mask)
+
+    if len(mask_array.shape) == 3:
+        mask_array = cv2.cvtColor(mask_array, cv2.COLOR_RGB2GRAY)
+
+    mask_array = mask_array.astype(np.float32) / 255.0
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    for i in range(passes):
+        mask_array = cv2.bilateralFilter(mask_array, 9, 75, 75)
+        mask_array = cv2.morphologyEx(mask_array, cv2.MORPH_CLOSE, kernel)
+        mask_array = cv2.morphologyEx(mask_array, cv2.MORPH_OPEN, kernel)
+
+        if i == 1:
+            laplacian = cv2.Laplacian(mask_array, cv2.CV_32F)
+            mask_array = cv2.addWeighted(mask_array, 1.5, laplacian, -0.5, 0, dtype=cv2.CV_32F)
+
+    if feather > 0:
+        mask_array = cv2.GaussianBlur(mask_array, (feather * 2 + 1, feather * 2 + 1), 0)
+        mask_array = cv2.normalize(mask_array, None, 0, 1, cv2.NORM_MINMAX, dtype=cv2.CV_32F)
+
+    mask_array = (mask_array * 255).clip(0, 255).astype(np.uint8)
+    return Image.fromarray(np.dstack((img_array[:, :, :3], mask_array)))
+
+
+def detail_enhancement(image):
+    """Enhance details in the processed image"""
+    img_array = np.asarray(image)
+
+    if image.mode == 'RGBA':
+        rgb = img_array[:, :, :3]
+        alpha = img_array[:, :, 3]
+        lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)
+    else:
+        lab = cv2.cvtColor(img_array, cv2.COLOR_RGB2LAB)
+
+    l, a, b = cv2.split(lab)
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    l = clahe.apply(l)
+
+    rgb = cv2.cvtColor(cv2.merge((l, a, b)), cv2.COLOR_LAB2RGB)
+
+    if image.mode == 'RGBA':
+        return Image.fromarray(np.dstack((rgb, alpha)))
+    return Image.fromarray(rgb)
+
+
+def apply_super_resolution(image):
+    """Apply super resolution to enhance details"""
+    # Placeholder for a real SR model such as ESRGAN
+    return image.resize((image.size[0]*2, image.size[1]*2), Image.LANCZOS)
+
+
+# Full resolution pixels at or above this alpha keep their original color
+OPAQUE_ALPHA = 250
+
+
+def upsample_alpha(cutout, img):
+    """Edge-aware upsampling of the alpha, guided by the original pixels
+
+    Opaque pixels keep the original full resolution colors. Pixels of the
+    soft edge still mix in the old background there, so they take the
+    matted foreground colors of the cutout instead, upsampled with the
+    alpha premultiplied so transparent neighbours do not darken them.
+    """
+    alpha = guided_upsample(cutout.getchannel('A'), img)
+    rgb = np.array(img.convert('RGB'))
+    alpha_array = np.asarray(alpha)
+    ys, xs = np.nonzero((alpha_array > 0) & (alpha_array < OPAQUE_ALPHA))
+    if ys.size:
+        low = np.asarray(cutout.convert('RGBA'), dtype=np.float32)
+        low_alpha = low[..., 3:] / 255.0
+        premultiplied = bilinear_sample(low[..., :3] * low_alpha, xs, ys, img.size)
+        coverage = bilinear_sample(low_alpha[..., 0], xs, ys, img.size)[:, np.newaxis]
+        foreground = premultiplied / np.maximum(coverage, 1e-3)
+        rgb[ys, xs] = np.clip(foreground + 0.5, 0, 255).astype(np.uint8)
+    result = Image.fromarray(rgb)
+    result.putalpha(alpha)
+    return result
+
+
+def apply_uv_effect(image):
+    """Glow and saturation boost"""
+    glow = image.filter(ImageFilter.GaussianBlur(3))
+    glow = ImageEnhance.Brightness(glow).enhance(1.3)
+    result = Image.blend(image, glow, 0.2)
+    return ImageEnhance.Color(result).enhance(1.8)
+
+
+def apply_finishing(image, settings):
+    """Final contrast, sharpness and effect adjustments"""
+    if settings['contrast_boost'] != 1.0:
+        image = ImageEnhance.Contrast(image).enhance(settings['contrast_boost'])
+    if settings['sharpness_boost'] > 0:
+        image = ImageEnhance.Sharpness(image).enhance(1.0 + settings['sharpness_boost'])
+    if settings['effect'] == "uv":
+        image = apply_uv_effect(image)
+    return image
+
+
+def apply_background(image, settings, background_assets):
+    """Apply background to the processed image"""
+    bg_type = settings['background_type']
+
+    if bg_type == "Color":
+        return composite(image, settings['bg_color'])
+
+    elif bg_type == "Gradient":
+        return apply_gradient_background(
+            image,
+            settings['gradient_start'],
+            settings['gradient_end'],
+            settings['gradient_mode'],
+            settings['gradient_angle']
+        )
+
+    elif bg_type == "Image":
+        try:
+            if settings['bg_image_bytes'] is None:
+                raise ValueError("Invalid background image data")
+            # Decoded and resized backdrops are reused across requests
+            bg_array = background_assets.get(settings['bg_image_bytes'], image.size, settings['bg_image_id'])
+            return composite(image, bg_array)
+        except Exception as e:
+            raise Exception(f"Error applying background image: {str(e)}")
+
+    return image
@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from collections import Counter
+
+
+class StackSampler:
+    """Samples one thread's Python call stack at a fixed interval
+
+    Used as a context manager around the work to profile. Stacks are kept
+    as root-to-leaf tuples of "function (file:line)" frames with the number
+    of samples that hit them, the same data a flame graph is drawn from.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def summary(self, top=15):
+        """Functions with the largest share of samples, inclusive and self"""
+        inclusive = Counter()
+        own = Counter()
+        for stack, count in self.stacks.items():
+            for name in set(stack):
+                inclusive[name] += count
+            own[stack[-1]] += count
+        total = max(self.samples, 1)
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "duration_ms": round(self.duration * 1000, 2),
+            "inclusive": [
+                {"function": name, "percent": round(count * 100 / total, 1)}
+                for name, count in inclusive.most_common(top)
+            ],
+            "self": [
+                {"function": name, "percent": round(count * 100 / total, 1)}
+                for name, count in own.most_common(top)
+            ],
+        }
+
+    def folded(self):
+        """Collapsed stacks ("a;b;c count" per line) for flame graph tools"""
+        return "\n".join(
+            f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()
+        ) + "\n"
+
+
+def profiled(func, *args, interval=0.005):
+    """Run func(*args) under a StackSampler; returns (result, sampler)"""
+    with StackSampler(interval=interval) as sampler:
+        result = func(*args)
+    return result, sampler
+
+
+def write_trace(directory, sampler, metadata):
+    """Write folded stacks and a JSON summary; returns the trace id"""
+    os.makedirs(directory, exist_ok=True)
+    trace_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    with open(os.path.join(directory, f"{trace_id}.folded"), "w") as f:
+        f.write(sampler.folded())
+    with open(os.path.join(directory, f"{trace_id}.json"), "w") as f:
+        json.dump(dict(metadata, profile=sampler.summary(top=50)), f, indent=2)
+    return trace_id
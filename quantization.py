@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from PIL import Image
+from batch_inference import MODEL_INPUTS
+
+# INT8 copies of the segmentation models, produced offline from the FP32
+# ONNX files and loaded by SessionRegistry under "<model>-int8"
+#
+#   python quantization.py quantize u2net_human_seg --mode static --images photos/
+#   python quantization.py validate u2net_human_seg --images photos/
+#
+# Quantizing needs the `onnx` package; serving the result does not. rembg
+# and OpenCV are imported where used, as SessionRegistry imports this module.
+
+QUANTIZED_SUFFIX = "-int8"
+QUANTIZATION_MODES = ("dynamic", "static")
+QUANTIZED_MODEL_DIR = os.getenv(
+    "QUANTIZED_MODEL_DIR",
+    os.path.join(os.getenv("U2NET_HOME", os.path.join("~", ".u2net")), "int8")
+)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff')
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def split_model_name(model_name):
+    """("u2net", True) for "u2net-int8", ("u2net", False) for "u2net" """
+    if model_name.endswith(QUANTIZED_SUFFIX):
+        return model_name[:-len(QUANTIZED_SUFFIX)], True
+    return model_name, False
+
+
+def quantized_model_path(model_name):
+    return os.path.join(os.path.expanduser(QUANTIZED_MODEL_DIR), f"{model_name}{QUANTIZED_SUFFIX}.onnx")
+
+
+def session_class(model_name):
+    """rembg session class of model_name"""
+    from rembg.sessions import sessions_class
+
+    for cls in sessions_class:
+        if cls.name() == model_name:
+            return cls
+    raise ValueError(f"No rembg session for model: {model_name}")
+
+
+def load_images(directory=None):
+    """RGB images from directory, or the bundled samples"""
+    if directory:
+        paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    else:
+        paths = [os.path.join(HERE, "image1.png"), os.path.join(HERE, "image2.png")]
+    if not paths:
+        raise SystemExit(f"No images found in {directory}")
+    images = []
+    for path in paths:
+        with Image.open(path) as image:
+            images.append((os.path.basename(path), image.convert('RGB')))
+    return images
+
+
+def quantize(model_name, mode="dynamic", images=None, output=None):
+    """Write an INT8 copy of model_name and return its path
+
+    Dynamic quantization converts the weights only. Static quantization
+    also fixes activation ranges from `images` (calibration set) and is
+    usually the faster of the two for convolutional models like U2Net.
+    """
+    # Only needed offline, and pulls in the onnx package
+    from onnxruntime import quantization as ort_quantization
+
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    source = session_class(model_name).download_models()
+    output = output or quantized_model_path(model_name)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    # Shape inference and graph cleanup let more nodes be quantized
+    prepared = f"{output}.prepared.onnx"
+    ort_quantization.quant_pre_process(source, prepared)
+    try:
+        if mode == "dynamic":
+            ort_quantization.quantize_dynamic(
+                prepared, output, weight_type=ort_quantization.QuantType.QUInt8
+            )
+        else:
+            from session_registry import SessionRegistry
+            mean, std, size = MODEL_INPUTS[model_name]
+            # The FP32 session normalizes calibration inputs exactly as at inference
+            session = SessionRegistry.from_env().get(model_name)
+
+            class Calibration(ort_quantization.CalibrationDataReader):
+                def __init__(self):
+                    self._inputs = iter(
+                        session.normalize(image, mean, std, size) for _, image in images or load_images()
+                    )
+
+                def get_next(self):
+                    return next(self._inputs, None)
+
+            ort_quantization.quantize_static(
+                prepared,
+                output,
+                Calibration(),
+                quant_format=ort_quantization.QuantFormat.QDQ,
+                activation_type=ort_quantization.QuantType.QUInt8,
+                weight_type=ort_quantization.QuantType.QInt8,
+                per_channel=True,
+            )
+    finally:
+        if os.path.exists(prepared):
+            os.remove(prepared)
+    return output
+
+
+def mask_iou(reference, candidate, threshold=128):
+    a = reference >= threshold
+    b = candidate >= threshold
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def edge_error(reference, candidate, band=5):
+    """Mean absolute alpha difference (0-1) within `band` px of the reference edge"""
+    import cv2
+
+    binary = (reference >= 128).astype(np.uint8)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (band * 2 + 1, band * 2 + 1))
+    edge = cv2.dilate(binary, kernel) != cv2.erode(binary, kernel)
+    if not edge.any():
+        return 0.0
+    diff = np.abs(reference.astype(np.float32) - candidate.astype(np.float32)) / 255.0
+    return float(diff[edge].mean())
+
+
+def timed_predict(session, image, repeat):
+    session.predict(image)  # warm-up
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        mask = session.predict(image)[0]
+        samples.append((time.perf_counter() - started) * 1000)
+    return np.asarray(mask.convert('L')), float(np.median(samples))
+
+
+def validate(model_name, images, repeat=3, sessions=None):
+    """Compare the INT8 copy against FP32 on images; returns a report dict"""
+    from session_registry import SessionRegistry
+    sessions = sessions or SessionRegistry.from_env()
+    reference = sessions.get(model_name)
+    candidate = sessions.get(model_name + QUANTIZED_SUFFIX)
+
+    rows = []
+    for name, image in images:
+        fp32_mask, fp32_ms = timed_predict(reference, image, repeat)
+        int8_mask, int8_ms = timed_predict(candidate, image, repeat)
+        rows.append({
+            "image": name,
+            "iou": round(mask_iou(fp32_mask, int8_mask), 4),
+            "edge_error": round(edge_error(fp32_mask, int8_mask), 4),
+            "fp32_ms": round(fp32_ms, 2),
+            "int8_ms": round(int8_ms, 2),
+        })
+
+    fp32_total = sum(row["fp32_ms"] for row in rows)
+    int8_total = sum(row["int8_ms"] for row in rows)
+    return {
+        "model": model_name,
+        "images": rows,
+        "mean_iou": round(float(np.mean([row["iou"] for row in rows])), 4),
+        "min_iou": round(min(row["iou"] for row in rows), 4),
+        "mean_edge_error": round(float(np.mean([row["edge_error"] for row in rows])), 4),
+        "speedup": round(fp32_total / int8_total, 2) if int8_total else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quantize segmentation models to INT8 and validate them")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    quantize_parser = commands.add_parser("quantize", help="write an INT8 copy of a model")
+    quantize_parser.add_argument("model", choices=list(MODEL_INPUTS))
+    quantize_parser.add_argument("--mode", choices=QUANTIZATION_MODES, default="static")
+    quantize_parser.add_argument("--images", help="calibration images for static mode (default: bundled samples)")
+
+    validate_parser = commands.add_parser("validate", help="compare an INT8 copy against FP32")
+    validate_parser.add_argument("model", choices=list(MODEL_INPUTS))
+    validate_parser.add_argument("--images", help="directory of test images (default: bundled samples)")
+    validate_parser.add_argument("--repeat", type=int, default=3)
+    validate_parser.add_argument("--min-iou", type=float, default=0.95, help="fail below this mean IoU")
+    validate_parser.add_argument("--max-edge-error", type=float, default=0.05, help="fail above this mean edge error")
+    validate_parser.add_argument("--output", help="write the report as JSON")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "quantize":
+        images = load_images(args.images) if args.mode == "static" else None
+        path = quantize(args.model, args.mode, images)
+        print(f"Wrote {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+        return 0
+
+    report = validate(args.model, load_images(args.images), args.repeat)
+    for row in report["images"]:
+        print(
+            f"{row['image']:<30} IoU {row['iou']:.4f}  edge error {row['edge_error']:.4f}  "
+            f"fp32 {row['fp32_ms']:8.1f} ms  int8 {row['int8_ms']:8.1f} ms"
+        )
+    print(
+        f"{args.model}: mean IoU {report['mean_iou']:.4f} (min {report['min_iou']:.4f}), "
+        f"mean edge error {report['mean_edge_error']:.4f}, speedup {report['speedup']}x"
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["mean_iou"] < args.min_iou or report["mean_edge_error"] > args.max_edge_error:
+        print("FAIL: INT8 masks differ from FP32 more than allowed")
+        return 1
+    print("PASS")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import os
+import platform
+
+# onnxruntime and cv2 are imported where they are used, so the API can
+# serve its first request before either is loaded
+
+EXECUTION_MODES = {
+    "sequential": "ORT_SEQUENTIAL",
+    "parallel": "ORT_PARALLEL",
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+# Threads used to solve alpha matting tiles in parallel
+MATTING_THREADS = int(os.getenv("MATTING_THREADS", "1"))
+
+
+class RuntimeConfig:
+    """Thread and graph settings for ONNX Runtime sessions and OpenCV
+
+    ONNX Runtime and OpenCV each size their thread pools to every core by
+    default, so several API workers on one node oversubscribe the CPU.
+    Thread counts of 0 keep the library default (one per core); an
+    `opencv_threads` of None leaves OpenCV alone.
+
+    With `optimized_model_dir` set, each model's optimized graph is saved
+    there on first load and later loads skip graph optimization.
+    """
+
+    def __init__(self, intra_op_threads=0, inter_op_threads=0, execution_mode="sequential",
+                 graph_optimization="all", opencv_threads=None, optimized_model_dir=None):
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(
+                f"Unknown execution mode: {execution_mode}. "
+                f"Choose one of: {', '.join(EXECUTION_MODES)}"
+            )
+        if graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(
+                f"Unknown graph optimization level: {graph_optimization}. "
+                f"Choose one of: {', '.join(GRAPH_OPTIMIZATION_LEVELS)}"
+            )
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.execution_mode = execution_mode
+        self.graph_optimization = graph_optimization
+        self.opencv_threads = opencv_threads
+        self.optimized_model_dir = optimized_model_dir
+
+    @classmethod
+    def from_env(cls):
+        """Build a config from ORT_* and OPENCV_THREADS environment variables"""
+        opencv_threads = os.getenv("OPENCV_THREADS")
+        return cls(
+            intra_op_threads=int(os.getenv("ORT_INTRA_OP_THREADS", "0")),
+            inter_op_threads=int(os.getenv("ORT_INTER_OP_THREADS", "0")),
+            execution_mode=os.getenv("ORT_EXECUTION_MODE", "sequential"),
+            graph_optimization=os.getenv("ORT_GRAPH_OPTIMIZATION", "all"),
+            opencv_threads=int(opencv_threads) if opencv_threads else None,
+            optimized_model_dir=os.getenv(
+                "ORT_OPTIMIZED_MODEL_DIR",
+                os.path.join(os.getenv("U2NET_HOME", os.path.join("~", ".u2net")), "optimized")
+            ) or None,
+        )
+
+    def session_options(self):
+        """ort.SessionOptions for a new inference session"""
+        import onnxruntime as ort
+
+        # Like rembg's new_session, fall back to OMP_NUM_THREADS
+        omp_threads = int(os.getenv("OMP_NUM_THREADS", "0"))
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads or omp_threads
+        options.inter_op_num_threads = self.inter_op_threads or omp_threads
+        options.execution_mode = getattr(ort.ExecutionMode, EXECUTION_MODES[self.execution_mode])
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization]
+        )
+        return options
+
+    def optimized_model_path(self, model_name):
+        """Where the optimized graph of model_name is kept, or None
+
+        Fully optimized graphs can depend on the CPU and ONNX Runtime build,
+        so both are part of the file name.
+        """
+        if not self.optimized_model_dir or self.graph_optimization == "disable":
+            return None
+        import onnxruntime as ort
+        name = f"{model_name}.{self.graph_optimization}.{platform.machine()}.ort-{ort.__version__}.onnx"
+        return os.path.join(os.path.expanduser(self.optimized_model_dir), name)
+
+    def apply_opencv(self):
+        """Set OpenCV's thread count for this process"""
+        if self.opencv_threads is not None:
+            import cv2
+            cv2.setNumThreads(self.opencv_threads)
+
+    def report(self):
+        """Effective values, with library defaults spelled out"""
+        import cv2
+        import onnxruntime as ort
+
+        cpus = os.cpu_count()
+        return {
+            "cpus": cpus,
+            "ort_version": ort.__version__,
+            "ort_providers": ort.get_available_providers(),
+            # Unset thread counts fall back to OMP_NUM_THREADS
+            "ort_intra_op_threads": self.intra_op_threads or int(os.getenv("OMP_NUM_THREADS", "0")) or cpus,
+            "ort_inter_op_threads": self.inter_op_threads or int(os.getenv("OMP_NUM_THREADS", "0")) or cpus,
+            "ort_execution_mode": self.execution_mode,
+            "ort_graph_optimization": self.graph_optimization,
+            "opencv_threads": cv2.getNumThreads(),
+            "matting_threads": MATTING_THREADS,
+            "optimized_model_dir": self.optimized_model_dir,
+        }
+
+    def describe(self):
+        return ", ".join(f"{key}={value}" for key, value in self.report().items())
+
+
+if __name__ == "__main__":
+    config = RuntimeConfig.from_env()
+    config.apply_opencv()
+    for key, value in config.report().items():
+        print(f"{key:<24} {value}")
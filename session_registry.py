@@ -0,0 +1,173 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from runtime_config import RuntimeConfig
+from quantization import QUANTIZED_SUFFIX, split_model_name, quantized_model_path, session_class
+
+SUPPORTED_MODELS = (
+    "u2net",
+    "u2netp",
+    "u2net_human_seg",
+    "isnet-general-use",
+    "silueta",
+)
+
+# Approximate resident memory of a loaded session in MB (weights plus
+# ONNX Runtime buffers), used to keep the registry under its budget
+MODEL_MEMORY_MB = {
+    "u2net": 220,
+    "u2netp": 20,
+    "u2net_human_seg": 220,
+    "isnet-general-use": 260,
+    "silueta": 70,
+}
+
+# INT8 weights take about a quarter of the FP32 size
+QUANTIZED_MEMORY_FACTOR = 0.35
+
+
+def model_memory_mb(model_name):
+    base, quantized = split_model_name(model_name)
+    return MODEL_MEMORY_MB[base] * (QUANTIZED_MEMORY_FACTOR if quantized else 1)
+
+
+class SessionRegistry:
+    """Process-wide rembg sessions, loaded on first use and evicted LRU
+
+    The estimated memory of resident sessions is kept under `max_mb`. The
+    most recently used session is never evicted, so a single model larger
+    than the budget still loads. New sessions use the thread and graph
+    options of `runtime`.
+
+    Every supported model can also be asked for as "<model>-int8", its
+    quantized copy (see quantization.py). `quality_models` picks the model
+    used for a quality tier when a request names none.
+
+    rembg and ONNX Runtime are only imported when the first session loads.
+    """
+
+    def __init__(self, max_mb=512, default_model="u2net_human_seg", factory=None, runtime=None,
+                 quality_models=None):
+        self.max_mb = max_mb
+        self.runtime = runtime or RuntimeConfig()
+        self.factory = factory or self._new_session
+        self.load_times = {}
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.quality_models = {}
+        self.default_model = self.resolve(default_model)
+        self.quality_models = {
+            quality: self.resolve(model_name)
+            for quality, model_name in (quality_models or {}).items() if model_name
+        }
+
+    @classmethod
+    def from_env(cls, runtime=None):
+        """Build a registry from MODEL_* and ORT_* environment variables"""
+        return cls(
+            max_mb=int(os.getenv("MODEL_MEMORY_BUDGET_MB", "512")),
+            default_model=os.getenv("DEFAULT_MODEL", "u2net_human_seg"),
+            runtime=runtime or RuntimeConfig.from_env(),
+            quality_models={
+                "Standard": os.getenv("STANDARD_MODEL"),
+                "Ultra HD": os.getenv("ULTRA_HD_MODEL"),
+            },
+        )
+
+    def _new_session(self, model_name):
+        """Load a rembg session, from the saved optimized graph when there is one
+
+        The model's own session class is always used, so pre- and
+        post-processing are the same whichever file the graph comes from.
+        """
+        import onnxruntime as ort
+
+        base, quantized = split_model_name(model_name)
+        options = self.runtime.session_options()
+        path = None
+        if quantized:
+            path = quantized_model_path(base)
+            if not os.path.exists(path):
+                raise ValueError(
+                    f"No quantized copy of {base} at {path}; "
+                    f"create it with: python quantization.py quantize {base}"
+                )
+
+        optimized = self.runtime.optimized_model_path(model_name)
+        pending = None
+        if optimized and os.path.exists(optimized):
+            path = optimized
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        elif optimized:
+            # Written under a temporary name so other workers never load a
+            # partial file
+            os.makedirs(os.path.dirname(optimized), exist_ok=True)
+            pending = f"{optimized}.{os.getpid()}.tmp"
+            options.optimized_model_filepath = pending
+
+        cls = session_class(base)
+        if path is not None:
+            cls = type(cls.__name__, (cls,), {
+                'download_models': classmethod(lambda cls, *args, **kwargs: path),
+            })
+        session = cls(base, options)
+        if pending is not None and os.path.exists(pending):
+            os.replace(pending, optimized)
+        return session
+
+    def resolve(self, model_name=None, quality=None):
+        """Return a supported model name, defaulting when none is given"""
+        model_name = model_name or self.quality_models.get(quality) or self.default_model
+        if split_model_name(model_name)[0] not in SUPPORTED_MODELS:
+            raise ValueError(
+                f"Unsupported model: {model_name}. "
+                f"Choose one of: {', '.join(SUPPORTED_MODELS)} "
+                f"(add {QUANTIZED_SUFFIX} for the quantized copy)"
+            )
+        return model_name
+
+    def get(self, model_name=None):
+        """Return the session for model_name, loading it if needed"""
+        model_name = self.resolve(model_name)
+        with self._lock:
+            session = self._sessions.get(model_name)
+            if session is not None:
+                self._sessions.move_to_end(model_name)
+                return session
+
+        # Load outside the registry lock so other models stay available, but
+        # only once per model even if several requests ask at the same time
+        with self._lock:
+            load_lock = self._load_locks.setdefault(model_name, threading.Lock())
+        with load_lock:
+            with self._lock:
+                session = self._sessions.get(model_name)
+                if session is not None:
+                    self._sessions.move_to_end(model_name)
+                    return session
+
+            start = time.perf_counter()
+            session = self.factory(model_name)
+            self.load_times[model_name] = time.perf_counter() - start
+
+            with self._lock:
+                self._sessions[model_name] = session
+                self._evict()
+            return session
+
+    @property
+    def resident_mb(self):
+        return sum(model_memory_mb(name) for name in self.loaded_models)
+
+    @property
+    def loaded_models(self):
+        # Worker threads load and evict sessions while metrics read this
+        with self._lock:
+            return list(self._sessions)
+
+    def _evict(self):
+        # Called with self._lock held
+        while len(self._sessions) > 1 and sum(map(model_memory_mb, self._sessions)) > self.max_mb:
+            self._sessions.popitem(last=False)
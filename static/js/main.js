@@ -18,6 +18,13 @@ const processedSpinner = document.getElementById('processed-spinner');
 // State
 let currentImage = null;
 let processedImageData = null;
+let processedResultId = null;
+let backgroundFile = null;
+let backgroundId = null;
+let processGeneration = 0;
+let reprocessTimer = null;
+let currentJobId = null;
+let previewedImage = null;
 
 // Event Listeners
 uploadArea.addEventListener('click', () => fileInput.click());
@@ -26,6 +33,11 @@ uploadArea.addEventListener('drop', handleDrop);
 fileInput.addEventListener('change', handleFileSelect);
 bgTypeSelect.addEventListener('change', handleBackgroundTypeChange);
 downloadBtn.addEventListener('click', handleDownload);
+document.querySelectorAll('.sidebar input, .sidebar select').forEach(control => {
+    if (control.type !== 'file') {
+        control.addEventListener('change', scheduleReprocess);
+    }
+});
 
 // Initialize slider values
 document.querySelectorAll('.slider-group input[type="range"]').forEach(slider => {
@@ -68,15 +80,14 @@ function handleFile(file) {
         return;
     }
 
-    const reader = new FileReader();
-    reader.onload = (e) => {
-        currentImage = e.target.result;
-        originalImage.src = currentImage;
-        imageComparison.style.display = 'block';
-        showProcessedSpinner();
-        processImage();
-    };
-    reader.readAsDataURL(file);
+    if (originalImage.src.startsWith('blob:')) {
+        URL.revokeObjectURL(originalImage.src);
+    }
+    currentImage = file;
+    originalImage.src = URL.createObjectURL(file);
+    imageComparison.style.display = 'block';
+    showProcessedSpinner();
+    processImage();
 }
 
 // Show/hide processed image spinner
@@ -104,49 +115,175 @@ async function processImage() {
         return;
     }
 
+    // Results of an older run are ignored once a newer one starts, and the
+    // server is told to stop working on it
+    const generation = ++processGeneration;
+    cancelCurrentJob();
+
     try {
-        showProcessedSpinner();
         const settings = getSettings();
-        const response = await fetch('/api/process', {
+        const formData = new FormData();
+        formData.append('image', currentImage);
+        Object.entries(settings).forEach(([key, value]) => {
+            formData.append(key, String(value));
+        });
+        // A quick preview only helps for a new image; after a settings
+        // change the previous result stays visible until the new one is ready
+        if (currentImage !== previewedImage) {
+            previewedImage = currentImage;
+            showProcessedSpinner();
+            formData.append('preview', 'true');
+        }
+        if (settings.background_type === 'Image') {
+            // Prefer the stored background id; upload the file only as a fallback
+            if (backgroundId) {
+                formData.append('bg_image_id', backgroundId);
+            } else if (backgroundFile) {
+                formData.append('bg_image', backgroundFile);
+            }
+        }
+
+        const response = await fetch('/api/jobs', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                image: currentImage,
-                settings: settings
-            })
+            body: formData
         });
 
-        let data;
-        try {
-            data = await response.json();
-        } catch (e) {
-            throw new Error('Invalid response from server');
+        if (response.status === 400 && formData.has('bg_image_id') && backgroundFile) {
+            // The stored background expired; send the file itself instead
+            backgroundId = null;
+            return processImage();
         }
-        
+
         if (!response.ok) {
-            throw new Error(data.detail || `Server error: ${response.status}`);
+            throw new Error(await responseError(response));
         }
-        
-        if (data.success) {
-            processedImageData = data.image;
-            processedImage.onload = () => {
-                hideProcessedSpinner();
-                processedImage.onload = null;
-            };
-            processedImage.src = processedImageData;
-        } else {
-            throw new Error(data.error || 'Failed to process image');
+
+        const job = await response.json();
+        if (generation !== processGeneration) {
+            // Superseded while the upload was in flight
+            cancelJob(job.id);
+            return;
         }
+        currentJobId = job.id;
+        await followJob(job.id, generation);
     } catch (error) {
-        showError(error.message);
+        if (generation === processGeneration) {
+            showError(error.message);
+            hideProcessedSpinner();
+        }
+    }
+}
+
+function cancelJob(jobId) {
+    fetch(`/api/jobs/${jobId}`, { method: 'DELETE' }).catch(() => {});
+}
+
+function cancelCurrentJob() {
+    if (currentJobId) {
+        cancelJob(currentJobId);
+        currentJobId = null;
+    }
+}
+
+// Show the preview as soon as it exists, then swap in the full result
+function followJob(jobId, generation) {
+    return new Promise((resolve, reject) => {
+        const events = new EventSource(`/api/jobs/${jobId}/events`);
+        let previewShown = false;
+        let finished = false;
+
+        events.onmessage = async (event) => {
+            const job = JSON.parse(event.data);
+            if (generation !== processGeneration) {
+                events.close();
+                resolve();
+                return;
+            }
+
+            if (job.preview && !previewShown && job.status !== 'done') {
+                previewShown = true;
+                const preview = await fetch(`/api/jobs/${jobId}/preview`);
+                if (preview.ok && !finished && generation === processGeneration) {
+                    showProcessedBlob(await preview.blob());
+                }
+            }
+
+            if (job.status === 'done' || job.status === 'failed') {
+                if (currentJobId === jobId) {
+                    currentJobId = null;
+                }
+            }
+
+            if (job.status === 'cancelled') {
+                finished = true;
+                events.close();
+                resolve();
+            } else if (job.status === 'failed') {
+                finished = true;
+                events.close();
+                reject(new Error(job.error || 'Failed to process image'));
+            } else if (job.status === 'done') {
+                finished = true;
+                events.close();
+                try {
+                    const result = await fetch(`/api/jobs/${jobId}/result`);
+                    if (!result.ok) {
+                        throw new Error(await responseError(result));
+                    }
+                    const blob = await result.blob();
+                    if (blob.size === 0) {
+                        throw new Error('Received empty image from server');
+                    }
+                    if (generation === processGeneration) {
+                        processedImageData = blob;
+                        processedResultId = job.result_id;
+                        showProcessedBlob(blob);
+                    }
+                    resolve();
+                } catch (error) {
+                    reject(error);
+                }
+            }
+        };
+
+        events.onerror = () => {
+            if (!finished) {
+                events.close();
+                reject(new Error('Lost connection to the server'));
+            }
+        };
+    });
+}
+
+function showProcessedBlob(blob) {
+    if (processedImage.src.startsWith('blob:')) {
+        URL.revokeObjectURL(processedImage.src);
+    }
+    processedImage.onload = () => {
         hideProcessedSpinner();
+        processedImage.onload = null;
+    };
+    processedImage.src = URL.createObjectURL(blob);
+}
+
+async function responseError(response) {
+    try {
+        const errorData = await response.json();
+        return errorData.detail || `Server error: ${response.status}`;
+    } catch (e) {
+        return response.statusText || `Server error: ${response.status}`;
     }
 }
 
+// Re-run processing shortly after settings stop changing
+function scheduleReprocess() {
+    if (!currentImage) return;
+    clearTimeout(reprocessTimer);
+    reprocessTimer = setTimeout(processImage, 300);
+}
+
 // Handle background image selection
-function handleBackgroundImageSelect(e) {
+async function handleBackgroundImageSelect(e) {
     const file = e.target.files[0];
     if (!file) return;
 
@@ -155,19 +292,38 @@ function handleBackgroundImageSelect(e) {
         return;
     }
 
-    const reader = new FileReader();
-    reader.onload = (e) => {
-        const bgPreview = document.getElementById('bg-preview');
-        bgPreview.innerHTML = `<img src="${e.target.result}" alt="Background Preview">`;
-        // Store the background image data
-        document.getElementById('bg-image').dataset.imageData = e.target.result;
-    };
-    reader.readAsDataURL(file);
+    backgroundFile = file;
+    backgroundId = null;
+    const bgPreview = document.getElementById('bg-preview');
+    bgPreview.innerHTML = `<img src="${URL.createObjectURL(file)}" alt="Background Preview">`;
+
+    // Store the background once on the server and reference it by id
+    try {
+        const formData = new FormData();
+        formData.append('image', file);
+        const response = await fetch('/api/backgrounds', {
+            method: 'POST',
+            body: formData
+        });
+        if (response.ok) {
+            const data = await response.json();
+            if (backgroundFile === file) {
+                backgroundId = data.id;
+            }
+        }
+    } catch (error) {
+        // Fall back to sending the file with each process request
+        backgroundId = null;
+    }
+    if (bgTypeSelect.value === 'Image') {
+        scheduleReprocess();
+    }
 }
 
 // Get current settings
 function getSettings() {
     const settings = {
+        model: document.getElementById('model-select')?.value || 'u2net_human_seg',
         quality: document.getElementById('quality-select')?.value || 'Ultra HD',
         edge_refinement: document.getElementById('edge-refinement')?.checked || true,
         preserve_details: document.getElementById('preserve-details')?.checked || true,
@@ -178,17 +334,13 @@ function getSettings() {
         bg_color: document.getElementById('bg-color')?.value || '#FFFFFF',
         gradient_start: document.getElementById('gradient-start')?.value || '#4CAF50',
         gradient_end: document.getElementById('gradient-end')?.value || '#2196F3',
+        gradient_mode: document.getElementById('gradient-mode')?.value || 'linear',
+        gradient_angle: parseInt(document.getElementById('gradient-angle')?.value || '45'),
         matting_foreground: parseInt(document.getElementById('foreground-threshold')?.value || '240'),
         matting_background: parseInt(document.getElementById('background-threshold')?.value || '10'),
         matting_erode: parseInt(document.getElementById('edge-refinement-size')?.value || '15')
     };
 
-    // Add background image data if available
-    const bgImageInput = document.getElementById('bg-image');
-    if (bgImageInput?.dataset.imageData) {
-        settings.bg_image = bgImageInput.dataset.imageData;
-    }
-
     return settings;
 }
 
@@ -224,16 +376,24 @@ async function handleDownload() {
 
     try {
         const format = document.querySelector('input[name="format"]:checked').value;
-        const response = await fetch('/api/download', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                image: processedImageData,
-                format: format
-            })
-        });
+        let response = null;
+        if (processedResultId) {
+            // The server kept the result; ask it to encode the chosen format
+            response = await fetch(`/api/results/${processedResultId}?format=${encodeURIComponent(format)}`);
+        }
+        if (!response || response.status === 404) {
+            const imageData = await blobToDataURL(processedImageData);
+            response = await fetch('/api/download', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    image: imageData,
+                    format: format
+                })
+            });
+        }
 
         if (!response.ok) {
             let errorMessage = 'Download failed';
@@ -264,6 +424,16 @@ async function handleDownload() {
     }
 }
 
+// Read a Blob as a data URL
+function blobToDataURL(blob) {
+    return new Promise((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onload = () => resolve(reader.result);
+        reader.onerror = () => reject(new Error('Failed to read processed image'));
+        reader.readAsDataURL(blob);
+    });
+}
+
 // Show processing status
 function showProcessingStatus() {
     processingStatus.style.display = 'block';
@@ -1,11 +1,9 @@
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk, ImageEnhance, ImageFilter
-import numpy as np
-from rembg import remove, new_session
+from PIL import Image, ImageTk
+from pipeline import Pipeline
 import threading
-import time
 
 class BGRemoverApp:
     def __init__(self, root):
@@ -13,8 +11,8 @@ class BGRemoverApp:
         self.root.title("Fast HD Background Remover")
         self.root.geometry("1000x700")
         
-        # Initialize AI model session (lighter weight model)
-        self.session = new_session("u2net")
+        # Shared processing pipeline; the model loads on first use
+        self.pipeline = Pipeline.from_env(default_model="u2net")
         
         # Variables
         self.input_path = ""
@@ -129,55 +127,25 @@ class BGRemoverApp:
     
     def process_image(self):
         try:
-            start_time = time.time()
-            
-            # Convert to RGB if needed
-            img = self.original_image.convert('RGB') if self.original_image.mode != 'RGB' else self.original_image
-            
-            # Resize for faster processing (maintain aspect ratio)
-            max_size = 1024
-            if max(img.size) > max_size:
-                ratio = max_size / max(img.size)
-                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                img = img.resize(new_size, Image.LANCZOS)
-            
-            # Process with rembg (using preloaded session)
-            result = remove(img, session=self.session)
-            
-            # Apply effect if needed
-            if self.effect_var.get() == "uv":
-                result = self.apply_uv_effect(result)
-            
-            # Store full resolution result
-            if img.size != self.original_image.size:
-                result = result.resize(self.original_image.size, Image.LANCZOS)
-            
-            self.processed_image = result
+            settings = {
+                'quality': "Standard",
+                'effect': self.effect_var.get(),
+            }
+            result = self.pipeline.run(self.original_image, settings)
+            self.processed_image = result.image
             
             # Update UI
             self.root.after(0, self.processing_complete)
             
-            proc_time = time.time() - start_time
-            print(f"Processing completed in {proc_time:.2f} seconds")
+            print(f"Processing completed in {result.total_ms / 1000:.2f} seconds")
+            for timing in result.timings:
+                print(f"  {timing.name:<10} {timing.wall_ms:8.1f} ms wall {timing.cpu_ms:8.1f} ms cpu")
             
         except Exception as e:
             self.root.after(0, self.processing_failed, str(e))
         finally:
             self.processing = False
     
-    def apply_uv_effect(self, img):
-        """Optimized UV effect application"""
-        # Create glow layer
-        glow = img.filter(ImageFilter.GaussianBlur(3))
-        glow = ImageEnhance.Brightness(glow).enhance(1.3)
-        
-        # Combine with original
-        result = Image.blend(img, glow, 0.2)
-        
-        # Enhance colors
-        result = ImageEnhance.Color(result).enhance(1.8)
-        return result
-    
     def processing_complete(self):
         self.display_image(self.processed_image, self.proc_canvas)
         self.save_btn.state(['!disabled'])
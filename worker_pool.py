@@ -0,0 +1,97 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class PoolFullError(Exception):
+    """Raised when the admission queue is full"""
+
+    def __init__(self, retry_after):
+        super().__init__("Server is busy, please retry later")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """Bounded worker pool that keeps blocking inference off the event loop
+
+    At most `max_workers` jobs run at once and at most `max_queue` more wait
+    for a worker. Anything beyond that is rejected with PoolFullError so
+    callers can answer 429 instead of piling up requests.
+    """
+
+    def __init__(self, max_workers=2, max_queue=4, kind="thread", retry_after=5):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._executor = None
+
+    @classmethod
+    def from_env(cls):
+        """Build a pool from INFERENCE_* environment variables"""
+        return cls(
+            max_workers=int(os.getenv("INFERENCE_WORKERS", "2")),
+            max_queue=int(os.getenv("INFERENCE_QUEUE_SIZE", "4")),
+            kind=os.getenv("INFERENCE_EXECUTOR", "thread"),
+            retry_after=int(os.getenv("INFERENCE_RETRY_AFTER", "5")),
+        )
+
+    @property
+    def executor(self):
+        # Created lazily so importing the app does not fork worker processes
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="inference",
+                )
+        return self._executor
+
+    @property
+    def in_flight(self):
+        """Jobs currently running on a worker"""
+        return min(self._admitted, self.max_workers)
+
+    @property
+    def queued(self):
+        """Jobs admitted but still waiting for a worker"""
+        return max(self._admitted - self.max_workers, 0)
+
+    def _admit(self):
+        with self._lock:
+            if self._admitted >= self.max_workers + self.max_queue:
+                raise PoolFullError(self.retry_after)
+            self._admitted += 1
+
+    def _release(self):
+        with self._lock:
+            self._admitted -= 1
+
+    def submit(self, func, *args):
+        """Admit func(*args) and return its concurrent.futures.Future"""
+        self._admit()
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self._release()
+            raise
+        # Release on completion rather than when the caller stops waiting, so a
+        # disconnected client still counts against capacity until its job ends
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    async def run(self, func, *args):
+        """Run func(*args) on the pool and await its result"""
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None